@@ -1,6 +1,7 @@
 from flask import Flask
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
 from datetime import datetime
 
@@ -14,16 +15,34 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    if app.config.get('PROXY_COUNT'):
+        # request.remote_addr becomes the client address the proxies saw
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'])
+
     login_manager.init_app(app)
     csrf.init_app(app)
 
-    from app import db
+    from app import coherence, db, instrumentation, metrics, outbox, profiling, ratelimit, user_import
     db.init_app(app)
+    instrumentation.init_app(app)
+    # Before any hook that might load the current user from the cache
+    coherence.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    ratelimit.init_app(app)
+    outbox.init_app(app)
+    user_import.init_app(app)
 
-    from app.routes import auth, events, admin
+    from app.routes import auth, events, admin, api
     app.register_blueprint(auth.bp)
     app.register_blueprint(events.bp)
     app.register_blueprint(admin.bp)
+    app.register_blueprint(api.bp)
+
+    from app.models import init_user_cache
+    from app.fragments import init_fragment_cache
+    init_user_cache(app)
+    init_fragment_cache(app)
 
     # Custom Jinja filters for datetime formatting
     def format_12hour(dt):
@@ -63,4 +82,23 @@ def create_app(config_class=Config):
         time_part = format_12hour(value)
         return f'{date_part} at {time_part}'
 
+    if app.config.get('PRELOAD_APP'):
+        preload(app)
+
     return app
+
+def preload(app):
+    """
+    Do up front the work each worker would otherwise repeat on first use:
+    import the email backend's dependencies and NumPy, and compile every
+    template. Under gunicorn --preload this runs once in the master, and
+    the workers it forks share the result copy-on-write.
+    """
+    from app.allocation import load_numpy
+    from app.email import get_backend
+
+    load_numpy()
+    with app.app_context():
+        get_backend().preload()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
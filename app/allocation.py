@@ -0,0 +1,170 @@
+"""Automatic ticket allocation from tiered preferences.
+
+Each submission lists the ticket counts a user would accept, e.g. "4,2,1,0"
+means ideally 4, otherwise 2 or 1. The engine works in two phases:
+
+1. Coverage: give as many people as possible one of their acceptable tiers.
+   Serving someone costs at least their smallest tier, so taking people in
+   order of smallest tier maximizes the number served.
+2. Upgrades: spend the remaining tickets moving served people up one tier at
+   a time, round-robin, skipping anyone whose next step no longer fits.
+
+Ties are broken by submission id (earlier submissions first), so the same
+input always produces the same allocation.
+"""
+
+from itertools import chain
+
+# Below this many submissions the pure-Python path is faster than NumPy setup
+NUMPY_THRESHOLD = 256
+
+_numpy = False  # Not imported yet; None once found missing
+
+
+def load_numpy():
+    """
+    Import NumPy on first use and return it, or None if it isn't installed.
+
+    Most requests never allocate, so workers don't pay for the import up
+    front (create_app's preload() calls this to share it across workers).
+    """
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:  # pragma: no cover - numpy is optional
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+def parse_tiers(preferences):
+    """
+    Return the acceptable (non-zero) tiers, ascending.
+
+    preferences is either a preferences string ("4,2,1,0") or a submission's
+    stored tier_mask, where bit n is set when n tickets are acceptable.
+    """
+    if isinstance(preferences, int):
+        return [n for n in range(1, preferences.bit_length()) if preferences >> n & 1]
+    if not preferences:
+        return []
+    values = {int(x) for x in preferences.split(',')}
+    values.discard(0)
+    return sorted(values)
+
+
+def allocate(submissions, total_tickets, use_numpy=None):
+    """
+    Compute an allocation for an event.
+
+    submissions is an iterable of (submission_id, preferences) pairs, where
+    preferences is a preferences string or a tier mask (see parse_tiers).
+    Returns a dict mapping every submission id to its allocated ticket count.
+    use_numpy forces a specific implementation; by default NumPy is used for
+    large events when it is installed.
+    """
+    entries = sorted((sub_id, parse_tiers(prefs)) for sub_id, prefs in submissions)
+    ids = [sub_id for sub_id, _ in entries]
+    tiers = [t for _, t in entries]
+
+    if use_numpy is None:
+        use_numpy = len(entries) >= NUMPY_THRESHOLD and load_numpy() is not None
+    if use_numpy:
+        levels = _allocate_numpy(tiers, total_tickets)
+    else:
+        levels = _allocate_python(tiers, total_tickets)
+
+    return {
+        sub_id: (tiers[i][levels[i]] if levels[i] >= 0 else 0)
+        for i, sub_id in enumerate(ids)
+    }
+
+
+def _allocate_python(tiers, total_tickets):
+    """Return the chosen tier index per submission (-1 for none)."""
+    levels = [-1] * len(tiers)
+    remaining = total_tickets
+
+    # Phase 1: cheapest minimums first
+    order = sorted((t[0], i) for i, t in enumerate(tiers) if t)
+    for minimum, i in order:
+        if minimum > remaining:
+            break
+        remaining -= minimum
+        levels[i] = 0
+
+    # Phase 2: round-robin upgrades in submission order
+    active = [i for i in range(len(tiers)) if levels[i] == 0]
+    while active and remaining > 0:
+        upgraded = []
+        for i in active:
+            nxt = levels[i] + 1
+            if nxt >= len(tiers[i]):
+                continue
+            step = tiers[i][nxt] - tiers[i][nxt - 1]
+            if step <= remaining:
+                remaining -= step
+                levels[i] = nxt
+                upgraded.append(i)
+        active = upgraded
+
+    return levels
+
+
+def _allocate_numpy(tiers, total_tickets):
+    """Vectorized equivalent of _allocate_python."""
+    np = load_numpy()
+    n = len(tiers)
+    counts = np.fromiter((len(t) for t in tiers), dtype=np.int64, count=n)
+    width = int(counts.max()) if n else 0
+    # Scatter the flattened tiers into an (n, width) matrix in one step
+    flat = np.fromiter(chain.from_iterable(tiers), dtype=np.int64, count=int(counts.sum()))
+    rows = np.repeat(np.arange(n), counts)
+    cols = np.arange(flat.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    matrix = np.zeros((n, max(width, 1)), dtype=np.int64)
+    matrix[rows, cols] = flat
+
+    levels = np.full(n, -1, dtype=np.int64)
+    remaining = int(total_tickets)
+
+    # Phase 1: sort by (minimum, position) and take the prefix that fits
+    candidates = np.nonzero(counts > 0)[0]
+    minimums = matrix[candidates, 0]
+    order = candidates[np.lexsort((candidates, minimums))]
+    spent = np.cumsum(matrix[order, 0])
+    served = int(np.searchsorted(spent, remaining, side='right'))
+    if served:
+        levels[order[:served]] = 0
+        remaining -= int(spent[served - 1])
+
+    # Phase 2: each round is a sequential "take it if it fits" scan over the
+    # active set. Anything that does not fit now never will (remaining only
+    # shrinks), so the scan is done as repeated cumulative-sum prefixes.
+    active = np.sort(order[:served])
+    while active.size and remaining > 0:
+        nxt = levels[active] + 1
+        has_next = nxt < counts[active]
+        active = active[has_next]
+        nxt = nxt[has_next]
+        steps = matrix[active, nxt] - matrix[active, nxt - 1]
+
+        accepted = np.zeros(active.size, dtype=bool)
+        start = 0
+        while start < active.size and remaining > 0:
+            fits = np.nonzero(steps[start:] <= remaining)[0] + start
+            if not fits.size:
+                break
+            running = np.cumsum(steps[fits])
+            taken = int(np.searchsorted(running, remaining, side='right'))
+            accepted[fits[:taken]] = True
+            remaining -= int(running[taken - 1])
+            if taken == fits.size:
+                break
+            # fits[taken] is skipped; resume the scan after it
+            start = int(fits[taken]) + 1
+
+        active = active[accepted]
+        levels[active] += 1
+
+    return levels.tolist()
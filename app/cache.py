@@ -0,0 +1,88 @@
+"""In-process caches shared by the models and views."""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional per-entry time-to-live.
+
+    Entries are bounded by count (maxsize) and, if maxbytes is set, by the
+    total sys.getsizeof() of the cached values.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, maxbytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize=None, ttl=None, maxbytes=None):
+        """Change the size/TTL limits and drop all entries."""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if maxbytes is not None:
+                self.maxbytes = maxbytes
+            self.ttl = ttl
+            self._data.clear()
+            self._bytes = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at, size = entry
+                if self.ttl is None or time.monotonic() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self._bytes -= size
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        size = sys.getsizeof(value) if self.maxbytes else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if self.maxbytes and size > self.maxbytes:
+                return  # Would evict everything else and still not fit
+            self._data[key] = (value, time.monotonic(), size)
+            self._bytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes and self._bytes > self.maxbytes):
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        stats = {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits,
+                 'misses': self.misses, 'evictions': self.evictions}
+        if self.maxbytes:
+            stats.update(bytes=self._bytes, maxbytes=self.maxbytes)
+        return stats
+
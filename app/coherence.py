@@ -0,0 +1,101 @@
+"""
+Keeps in-process caches coherent across gunicorn workers.
+
+Every write to users, events or submissions bumps a counter for its
+namespace in cache_versions (see the triggers in schema.sql). Once per
+request, before the view runs, the tracker asks SQLite whether anything
+was committed since this thread last looked:
+
+- PRAGMA data_version changes when another connection (another worker or
+  thread) has committed, and costs no I/O.
+- connection.total_changes grows with this connection's own writes.
+
+Only when one of them moved are the namespace counters read, and only the
+caches registered for namespaces whose counter changed are cleared.
+
+Caches can also key their entries by version(namespace), the counter as of
+the start of the request, so an entry stored from an older snapshot can
+never be served once the namespace has moved on.
+"""
+
+import threading
+from flask import g, has_app_context, request
+from app.db import get_db
+
+
+class Tracker:
+    """Namespace -> caches registry, synced against cache_versions."""
+
+    def __init__(self):
+        self.persistent = False  # Fast path needs one long-lived connection per thread
+        self._caches = {}  # namespace -> [cache, ...]
+        self._versions = {}  # namespace -> last version seen by this process
+        self._seen = threading.local()
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.reloads = 0
+
+    def register(self, namespace, cache):
+        """Clear cache whenever namespace's version changes."""
+        with self._lock:
+            caches = self._caches.setdefault(namespace, [])
+            if cache not in caches:
+                caches.append(cache)
+
+    def sync(self, db):
+        """Clear caches of namespaces changed since the last sync; once per request."""
+        self.checks += 1
+        data_version = db.execute('PRAGMA data_version').fetchone()[0]
+        marker = (id(db), data_version, db.total_changes)
+        if not (self.persistent and getattr(self._seen, 'marker', None) == marker and self._versions):
+            self._reload(db)
+            self._seen.marker = marker
+        with self._lock:
+            g.cache_versions = (dict(self._versions), db.total_changes)
+
+    def _reload(self, db):
+        self.reloads += 1
+        with self._lock:
+            # Read under the lock so a slower thread can't store older versions
+            rows = db.execute('SELECT namespace, version FROM cache_versions').fetchall()
+            for namespace, version in rows:
+                if self._versions.get(namespace) != version:
+                    for cache in self._caches.get(namespace, ()):
+                        cache.clear()
+                    self._versions[namespace] = version
+
+    def version(self, namespace):
+        """
+        namespace's version as of the start of this request, or None outside
+        a synced request or once the request has written to the database
+        (its own changes aren't reflected yet).
+        """
+        if not has_app_context():
+            return None
+        synced = g.get('cache_versions')
+        if synced is None:
+            return None
+        versions, total_changes = synced
+        if get_db().total_changes != total_changes:
+            return None
+        return versions.get(namespace)
+
+    def reset(self):
+        """Forget every version seen, so the next sync clears all caches."""
+        with self._lock:
+            self._versions.clear()
+        self._seen = threading.local()
+
+
+tracker = Tracker()
+
+
+def _sync():
+    if request.endpoint != 'static':
+        tracker.sync(get_db())
+
+
+def init_app(app):
+    tracker.persistent = bool(app.config.get('SQLITE_PERSISTENT_CONNECTIONS'))
+    tracker.reset()
+    app.before_request(_sync)
@@ -0,0 +1,65 @@
+"""Conditional GET support (ETag / Last-Modified) for read-heavy pages."""
+
+import hashlib
+import time
+from datetime import datetime, timezone
+from flask import current_app, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+
+def _parse_timestamp(value):
+    """SQLite CURRENT_TIMESTAMP strings are UTC without an offset."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class Validators:
+    """A weak ETag and Last-Modified time computed from cheap version stamps."""
+
+    def __init__(self, parts, last_modified=None):
+        # Pages embed CSRF tokens that expire and are tied to the session's
+        # CSRF secret; roll the ETag over with both so a revalidated page
+        # never carries a token the session no longer accepts.
+        config = current_app.config
+        time_limit = config.get('WTF_CSRF_TIME_LIMIT') or None
+        if time_limit:
+            parts = (*parts, int(time.time() // time_limit))
+        csrf_secret = session.get(config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+        if csrf_secret:
+            parts = (*parts, hashlib.sha1(str(csrf_secret).encode()).hexdigest())
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+        self.etag = digest
+        self.last_modified = _parse_timestamp(last_modified)
+
+    def not_modified(self):
+        """
+        Return a 304 response if the client's copy is current, else None.
+
+        Call this before running any expensive queries. Requests that have
+        flashed messages waiting are always rendered in full.
+        """
+        if session.get('_flashes'):
+            return None
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if is_resource_modified(request.environ, etag=self.etag, last_modified=self.last_modified):
+            return None
+        return self.apply(make_response('', 304))
+
+    def apply(self, response):
+        """Attach the validators to a rendered response."""
+        response = make_response(response)
+        response.set_etag(self.etag, weak=True)
+        if self.last_modified is not None:
+            response.last_modified = self.last_modified
+        # Pages are per-user; browsers may keep them but must revalidate
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
@@ -1,24 +1,192 @@
+import os
+import re
 import sqlite3
+import threading
+import click
 from flask import current_app, g
+from app import instrumentation
+
+# Persistent connections, one per thread and database (see get_db)
+_local = threading.local()
+
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+def _pragmas(config):
+    """PRAGMAs applied to every new connection, from the app config."""
+    pragmas = [
+        ('journal_mode', config.get('SQLITE_JOURNAL_MODE')),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS')),
+        ('busy_timeout', config.get('SQLITE_BUSY_TIMEOUT')),
+        ('cache_size', config.get('SQLITE_CACHE_SIZE')),
+        ('mmap_size', config.get('SQLITE_MMAP_SIZE')),
+        ('temp_store', config.get('SQLITE_TEMP_STORE')),
+    ]
+    return [(name, value) for name, value in pragmas if value is not None]
+
+def _connect(config):
+    db = sqlite3.connect(
+        config['DATABASE'],
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        factory=instrumentation.InstrumentedConnection if config.get('SQL_INSTRUMENTATION')
+        else sqlite3.Connection
+    )
+    db.row_factory = sqlite3.Row
+    for name, value in _pragmas(config):
+        if not _PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f'Invalid value for PRAGMA {name}: {value!r}')
+        db.execute(f'PRAGMA {name} = {value}')
+    return db
+
+def _thread_connection(config):
+    """Return this thread's connection, opening it on first use."""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    # Keyed by pid so a forked worker never reuses its parent's connection
+    key = (os.getpid(), config['DATABASE'])
+    db = connections.get(key)
+    if db is None:
+        db = connections[key] = _connect(config)
+    return db
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        config = current_app.config
+        if config.get('SQLITE_PERSISTENT_CONNECTIONS'):
+            g.db = _thread_connection(config)
+        else:
+            g.db = _connect(config)
+        instrumentation.attach(g.db)
     return g.db
 
 def close_db(e=None):
     db = g.pop('db', None)
-    if db is not None:
+    if db is None:
+        return
+    instrumentation.detach(db)
+    if current_app.config.get('SQLITE_PERSISTENT_CONNECTIONS'):
+        # Keep the connection, but never leak an open transaction into the next request
+        if db.in_transaction:
+            db.rollback()
+    else:
         db.close()
 
+# Columns added to submissions after the first release
+_SUBMISSION_COLUMNS = [
+    ('first_choice', 'INTEGER NOT NULL DEFAULT 0'),
+    ('min_acceptable', 'INTEGER NOT NULL DEFAULT 0'),
+    ('tier_mask', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# Columns added to event_stats after it was introduced
+_EVENT_STATS_COLUMNS = [
+    ('version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('modified_at', 'DATETIME'),
+]
+
+# Columns added to email_outbox after it was introduced
+_EMAIL_OUTBOX_COLUMNS = [
+    ('template', 'TEXT'),
+    ('template_data', 'TEXT'),
+]
+
 def init_db():
     db = get_db()
+    backfill = migrate_db()
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
+    if backfill:
+        backfill_submission_preferences()
+    # Backfill stats for databases created before event_stats existed
+    rebuild_event_stats()
+
+def migrate_db():
+    """
+    Add columns missing from an existing database.
+
+    Returns True if submissions gained the derived preference columns and
+    need backfill_submission_preferences().
+    """
+    db = get_db()
+    existing = {row['name'] for row in db.execute('PRAGMA table_info(submissions)')}
+    if not existing:
+        return False  # Fresh database; schema.sql creates everything
+    missing = [(name, definition) for name, definition in _SUBMISSION_COLUMNS if name not in existing]
+    for name, definition in missing:
+        db.execute(f'ALTER TABLE submissions ADD COLUMN {name} {definition}')
+
+    stats_columns = {row['name'] for row in db.execute('PRAGMA table_info(event_stats)')}
+    if stats_columns:
+        for name, definition in _EVENT_STATS_COLUMNS:
+            if name not in stats_columns:
+                db.execute(f'ALTER TABLE event_stats ADD COLUMN {name} {definition}')
+
+    outbox_columns = {row['name'] for row in db.execute('PRAGMA table_info(email_outbox)')}
+    if outbox_columns:
+        for name, definition in _EMAIL_OUTBOX_COLUMNS:
+            if name not in outbox_columns:
+                db.execute(f'ALTER TABLE email_outbox ADD COLUMN {name} {definition}')
+    db.commit()
+    return bool(missing)
+
+def backfill_submission_preferences():
+    """Recompute the derived preference columns of every submission."""
+    from app.models import encode_preferences
+
+    db = get_db()
+    rows = db.execute('SELECT id, preferences FROM submissions').fetchall()
+    updates = []
+    for row in rows:
+        _, first_choice, min_acceptable, tier_mask = encode_preferences(row['preferences'])
+        updates.append((first_choice, min_acceptable, tier_mask, row['id']))
+    with db:
+        db.executemany(
+            'UPDATE submissions SET first_choice = ?, min_acceptable = ?, tier_mask = ? WHERE id = ?',
+            updates
+        )
+
+def rebuild_event_stats():
+    """
+    Recompute the event_stats table from submissions (for recovery).
+
+    Versions are bumped rather than reset so pages validated against an
+    earlier version are never mistaken for current.
+    """
+    db = get_db()
+    with db:
+        db.execute('DELETE FROM event_stats WHERE event_id NOT IN (SELECT id FROM events)')
+        db.execute(
+            '''INSERT OR REPLACE INTO event_stats
+                   (event_id, submission_count, total_first_choice, total_min, total_allocated,
+                    version, modified_at)
+               SELECT e.id,
+                      COUNT(s.id),
+                      COALESCE(SUM(s.first_choice), 0),
+                      COALESCE(SUM(s.min_acceptable), 0),
+                      COALESCE(SUM(s.allocated), 0),
+                      COALESCE(old.version, 0) + 1,
+                      CURRENT_TIMESTAMP
+               FROM events e
+               LEFT JOIN submissions s ON s.event_id = e.id
+               LEFT JOIN event_stats old ON old.event_id = e.id
+               GROUP BY e.id'''
+        )
+        db.execute("UPDATE cache_versions SET version = version + 1 WHERE namespace = 'events'")
+
+@click.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute per-event statistics from submissions."""
+    rebuild_event_stats()
+    click.echo('Event statistics rebuilt.')
+
+@click.command('purge-login-tokens')
+def purge_login_tokens_command():
+    """Delete used and expired magic-link tokens."""
+    from app.models import User
+
+    click.echo(f'Deleted {User.purge_login_tokens()} login token(s).')
 
 def init_app(app):
     app.teardown_appcontext(close_db)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(purge_login_tokens_command)
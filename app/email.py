@@ -1,192 +1,507 @@
-"""Email utility module using AWS SES."""
-
-import boto3
-from botocore.exceptions import ClientError
+"""
+Email utility module.
+
+Messages go through a backend: LogBackend prints them (MAIL_ENABLED=false)
+and SESBackend sends them with AWS SES. MAIL_BACKEND names the backend used
+when mail is enabled, either one of BACKENDS or a dotted path to a class.
+boto3 is only imported when the SES backend first needs it, so importing
+this module (and so every blueprint) stays cheap.
+"""
+
+import json
+import os
+import re
+import threading
+import time
 from flask import current_app
+from markupsafe import escape
+from werkzeug.utils import import_string
 import logging
+from app import metrics, outbox
 
 logger = logging.getLogger(__name__)
 
+# SES accepts at most 50 destinations per SendBulkTemplatedEmail call
+SES_BULK_LIMIT = 50
 
-def send_email(to, subject, body_html, body_text=None):
+_PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+_SECTION = re.compile(r'\{\{#if\s+(\w+)\s*\}\}(.*?)\{\{/if\s*\}\}', re.S)
+
+
+def _compile_placeholders(source, html):
+    parts = _PLACEHOLDER.split(source)
+    literals = parts[0::2]
+    names = parts[1::2]
+
+    def render(data):
+        out = [literals[0]]
+        for name, literal in zip(names, literals[1:]):
+            value = data.get(name, '')
+            out.append(str(escape(value)) if html else str(value))
+            out.append(literal)
+        return ''.join(out)
+
+    return render
+
+
+def _compile(source, html=False):
     """
-    Send an email using AWS SES.
+    Compile a template into a function that renders a data dict.
 
-    If MAIL_ENABLED is False, logs the email instead of sending.
-    Returns True on success, False on failure.
+    Supports {{name}} placeholders and (unnested) {{#if name}}...{{/if}}
+    sections, which render only when name is set and truthy, as SES does.
     """
-    config = current_app.config
+    pieces = []
+    position = 0
+    for match in _SECTION.finditer(source):
+        pieces.append(_compile_placeholders(source[position:match.start()], html))
+        name, body = match.group(1), _compile_placeholders(match.group(2), html)
+        pieces.append(lambda data, name=name, body=body: body(data) if data.get(name) else '')
+        position = match.end()
+    pieces.append(_compile_placeholders(source[position:], html))
 
-    if not config.get('MAIL_ENABLED'):
-        logger.info(f"[EMAIL DISABLED] Would send to: {to}")
-        logger.info(f"[EMAIL DISABLED] Subject: {subject}")
-        logger.info(f"[EMAIL DISABLED] Body: {body_text or body_html}")
-        print(f"\n{'='*50}")
-        print(f"EMAIL (disabled - not sent)")
-        print(f"To: {to}")
-        print(f"Subject: {subject}")
-        print(f"Body:\n{body_text or body_html}")
-        print(f"{'='*50}\n")
-        return True
+    if len(pieces) == 1:
+        return pieces[0]
+    return lambda data: ''.join(piece(data) for piece in pieces)
 
-    try:
-        client = boto3.client(
-            'ses',
-            region_name=config.get('AWS_REGION'),
-            aws_access_key_id=config.get('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=config.get('AWS_SECRET_ACCESS_KEY')
-        )
 
-        response = client.send_email(
-            Source=config.get('SES_SENDER_EMAIL'),
-            Destination={'ToAddresses': [to]},
-            Message={
-                'Subject': {'Data': subject, 'Charset': 'UTF-8'},
-                'Body': {
-                    'Html': {'Data': body_html, 'Charset': 'UTF-8'},
-                    'Text': {'Data': body_text or body_html, 'Charset': 'UTF-8'}
-                }
-            }
-        )
-        logger.info(f"Email sent to {to}: {response['MessageId']}")
-        return True
+class MessageTemplate:
+    """
+    An email template compiled once and rendered per recipient.
 
-    except ClientError as e:
-        logger.error(f"Failed to send email to {to}: {e.response['Error']['Message']}")
-        return False
-    except Exception as e:
-        logger.error(f"Unexpected error sending email to {to}: {str(e)}")
-        return False
+    Placeholders use SES template syntax ({{name}}), so the same source can
+    be registered with SES for templated bulk sends.
+    """
 
+    def __init__(self, name, subject, html, text):
+        self.name = name
+        self.subject = subject
+        self.html = html
+        self.text = text
+        self._render_subject = _compile(subject)
+        self._render_html = _compile(html, html=True)
+        self._render_text = _compile(text)
 
-def send_magic_link_email(user, login_url):
-    """Send a magic link login email to the user."""
-    app_name = current_app.config.get('APP_NAME', 'Ticket Allocation')
+    def render(self, data):
+        """Return (subject, body_html, body_text) for the given data."""
+        return self._render_subject(data), self._render_html(data), self._render_text(data)
 
-    subject = f"{app_name} - Your Login Link"
 
-    body_html = f"""
+MAGIC_LINK_TEMPLATE = MessageTemplate(
+    'magic-link',
+    '{{app_name}} - Your Login Link',
+    """
     <html>
     <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
         <h2>Your Login Link</h2>
-        <p>Hi {user.name},</p>
-        <p>Click the button below to log in to {app_name}:</p>
-        <p><a href="{login_url}" style="background-color: #3498db; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block;">Log In</a></p>
-        <p>Or copy this link: <a href="{login_url}">{login_url}</a></p>
+        <p>Hi {{name}},</p>
+        <p>Click the button below to log in to {{app_name}}:</p>
+        <p><a href="{{login_url}}" style="background-color: #3498db; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block;">Log In</a></p>
+        <p>Or copy this link: <a href="{{login_url}}">{{login_url}}</a></p>
         <p>This link will expire in 15 minutes and can only be used once.</p>
         <p>If you didn't request this, you can safely ignore this email.</p>
         <br>
-        <p>Thanks,<br>{app_name}</p>
+        <p>Thanks,<br>{{app_name}}</p>
     </body>
     </html>
+    """,
     """
-
-    body_text = f"""
 Your Login Link
 
-Hi {user.name},
+Hi {{name}},
 
-Click here to log in to {app_name}: {login_url}
+Click here to log in to {{app_name}}: {{login_url}}
 
 This link will expire in 15 minutes and can only be used once.
 
 If you didn't request this, you can safely ignore this email.
 
 Thanks,
-{app_name}
+{{app_name}}
     """
+)
 
-    return send_email(user.email, subject, body_html, body_text)
+WELCOME_TEMPLATE = MessageTemplate(
+    'welcome',
+    'Welcome to {{app_name}}',
+    """
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <h2>Welcome to {{app_name}}!</h2>
+        <p>Hi {{name}},</p>
+        <p>An account has been created for you at {{app_name}}.</p>
+        <p>Click the button below to log in and get started:</p>
+        <p><a href="{{login_url}}" style="background-color: #27ae60; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block;">Log In</a></p>
+        <p>Or copy this link: <a href="{{login_url}}">{{login_url}}</a></p>
+        <p>This link will expire in 15 minutes. After that, you can request a new one from the login page.</p>
+        <br>
+        <p>Thanks,<br>{{app_name}}</p>
+    </body>
+    </html>
+    """,
+    """
+Welcome to {{app_name}}!
 
+Hi {{name}},
 
-def send_welcome_email(user, login_url):
-    """Send a welcome email to a new user with their first login link."""
-    app_name = current_app.config.get('APP_NAME', 'Ticket Allocation')
+An account has been created for you at {{app_name}}.
 
-    subject = f"Welcome to {app_name}"
+Click here to log in and get started: {{login_url}}
 
-    body_html = f"""
+This link will expire in 15 minutes. After that, you can request a new one from the login page.
+
+Thanks,
+{{app_name}}
+    """
+)
+
+_ALLOCATION_HTML = """
     <html>
     <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-        <h2>Welcome to {app_name}!</h2>
-        <p>Hi {user.name},</p>
-        <p>An account has been created for you at {app_name}.</p>
-        <p>Click the button below to log in and get started:</p>
-        <p><a href="{login_url}" style="background-color: #27ae60; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block;">Log In</a></p>
-        <p>Or copy this link: <a href="{login_url}">{login_url}</a></p>
-        <p>This link will expire in 15 minutes. After that, you can request a new one from the login page.</p>
+        <h2>Ticket Allocation Update</h2>
+        <p>Hi {{name}},</p>
+        <p>%s</p>
+        <p><strong>Event:</strong> {{event_name}}</p>
+        <p><strong>Date:</strong> {{event_date}}</p>
+        {{#if event_url}}<p><a href="{{event_url}}" style="background-color: #3498db; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block;">View Event Details</a></p>{{/if}}
         <br>
-        <p>Thanks,<br>{app_name}</p>
+        <p>Thanks,<br>{{app_name}}</p>
     </body>
     </html>
     """
 
-    body_text = f"""
-Welcome to {app_name}!
+_ALLOCATION_TEXT = """
+Ticket Allocation Update
 
-Hi {user.name},
+Hi {{name}},
 
-An account has been created for you at {app_name}.
+%s
 
-Click here to log in and get started: {login_url}
+Event: {{event_name}}
+Date: {{event_date}}
 
-This link will expire in 15 minutes. After that, you can request a new one from the login page.
+{{#if event_url}}View event details: {{event_url}}{{/if}}
 
 Thanks,
-{app_name}
+{{app_name}}
     """
 
-    return send_email(user.email, subject, body_html, body_text)
+ALLOCATION_GRANTED_TEMPLATE = MessageTemplate(
+    'allocation-granted',
+    '{{app_name}} - Ticket Allocation for {{event_name}}',
+    _ALLOCATION_HTML % 'Great news! You requested {{requested}} {{requested_word}} and have been allocated <strong>{{allocated}} {{allocated_word}}</strong> for {{event_name}}.',
+    _ALLOCATION_TEXT % 'Great news! You requested {{requested}} {{requested_word}} and have been allocated {{allocated}} {{allocated_word}} for {{event_name}}.'
+)
 
+ALLOCATION_NONE_TEMPLATE = MessageTemplate(
+    'allocation-none',
+    '{{app_name}} - Ticket Allocation for {{event_name}}',
+    _ALLOCATION_HTML % 'You requested {{requested}} {{requested_word}}, but unfortunately we were unable to allocate any tickets for {{event_name}} this time.',
+    _ALLOCATION_TEXT % 'You requested {{requested}} {{requested_word}}, but unfortunately we were unable to allocate any tickets for {{event_name}} this time.'
+)
 
-def send_allocation_email(user, event, requested_tickets, allocated_tickets):
-    """Send an email notifying a user of their ticket allocation."""
-    app_name = current_app.config.get('APP_NAME', 'Ticket Pool')
-    app_url = current_app.config.get('APP_URL', '')
+TEMPLATES = {
+    template.name: template
+    for template in (MAGIC_LINK_TEMPLATE, WELCOME_TEMPLATE,
+                     ALLOCATION_GRANTED_TEMPLATE, ALLOCATION_NONE_TEMPLATE)
+}
 
-    subject = f"{app_name} - Ticket Allocation for {event.name}"
+class LogBackend:
+    """Prints messages instead of sending them."""
 
-    req_word = "ticket" if requested_tickets == 1 else "tickets"
-    alloc_word = "ticket" if allocated_tickets == 1 else "tickets"
+    bulk = False  # send_bulk() falls back to one send() per recipient
 
-    if allocated_tickets > 0:
-        message = f"Great news! You requested {requested_tickets} {req_word} and have been allocated <strong>{allocated_tickets} {alloc_word}</strong> for {event.name}."
-        message_text = f"Great news! You requested {requested_tickets} {req_word} and have been allocated {allocated_tickets} {alloc_word} for {event.name}."
-    else:
-        message = f"You requested {requested_tickets} {req_word}, but unfortunately we were unable to allocate any tickets for {event.name} this time."
-        message_text = message
+    def preload(self):
+        pass
 
-    event_url = f"{app_url}/events/{event.id}" if app_url else ""
+    def send(self, to, subject, body_html, body_text=None):
+        logger.info(f"[EMAIL DISABLED] Would send to: {to}")
+        logger.info(f"[EMAIL DISABLED] Subject: {subject}")
+        logger.info(f"[EMAIL DISABLED] Body: {body_text or body_html}")
+        print(f"\n{'='*50}")
+        print(f"EMAIL (disabled - not sent)")
+        print(f"To: {to}")
+        print(f"Subject: {subject}")
+        print(f"Body:\n{body_text or body_html}")
+        print(f"{'='*50}\n")
+        return True
 
-    body_html = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-        <h2>Ticket Allocation Update</h2>
-        <p>Hi {user.name},</p>
-        <p>{message}</p>
-        <p><strong>Event:</strong> {event.name}</p>
-        <p><strong>Date:</strong> {event.event_date}</p>
-        {f'<p><a href="{event_url}" style="background-color: #3498db; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block;">View Event Details</a></p>' if event_url else ''}
-        <br>
-        <p>Thanks,<br>{app_name}</p>
-    </body>
-    </html>
+
+class SESBackend:
+    """Sends through AWS SES, with templated bulk sends."""
+
+    bulk = True
+
+    def __init__(self):
+        self._clients = {}
+        self._templates = set()
+        self._lock = threading.Lock()
+
+    def preload(self):
+        """Import boto3 now rather than on the first send (for gunicorn --preload)."""
+        import boto3  # noqa: F401
+        import botocore.config  # noqa: F401
+        import botocore.exceptions  # noqa: F401
+
+    def client(self):
+        """Return the process-wide SES client for the current configuration."""
+        config = current_app.config
+        # Keyed by pid so forked workers never share a connection pool
+        key = (os.getpid(), config.get('AWS_REGION'), config.get('AWS_ACCESS_KEY_ID'))
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    import boto3
+                    from botocore.config import Config as BotoConfig
+
+                    client = boto3.client(
+                        'ses',
+                        region_name=config.get('AWS_REGION'),
+                        aws_access_key_id=config.get('AWS_ACCESS_KEY_ID'),
+                        aws_secret_access_key=config.get('AWS_SECRET_ACCESS_KEY'),
+                        config=BotoConfig(
+                            max_pool_connections=config.get('SES_MAX_POOL_CONNECTIONS', 10),
+                            retries={'max_attempts': 3, 'mode': 'standard'}
+                        )
+                    )
+                    self._clients[key] = client
+        return client
+
+    def send(self, to, subject, body_html, body_text=None):
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client().send_email(
+                Source=current_app.config.get('SES_SENDER_EMAIL'),
+                Destination={'ToAddresses': [to]},
+                Message={
+                    'Subject': {'Data': subject, 'Charset': 'UTF-8'},
+                    'Body': {
+                        'Html': {'Data': body_html, 'Charset': 'UTF-8'},
+                        'Text': {'Data': body_text or body_html, 'Charset': 'UTF-8'}
+                    }
+                }
+            )
+            logger.info(f"Email sent to {to}: {response['MessageId']}")
+            return True
+
+        except ClientError as e:
+            logger.error(f"Failed to send email to {to}: {e.response['Error']['Message']}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error sending email to {to}: {str(e)}")
+            return False
+
+    def prepare(self, template):
+        """Register (or refresh) a template with SES once per process; returns its SES name."""
+        from botocore.exceptions import ClientError
+
+        prefix = current_app.config.get('SES_TEMPLATE_PREFIX', 'ticket-pool')
+        name = f'{prefix}-{template.name}'
+        if name in self._templates:
+            return name
+        client = self.client()
+        definition = {
+            'TemplateName': name,
+            'SubjectPart': template.subject,
+            'HtmlPart': template.html,
+            'TextPart': template.text
+        }
+        try:
+            client.update_template(Template=definition)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TemplateDoesNotExist':
+                raise
+            client.create_template(Template=definition)
+        self._templates.add(name)
+        return name
+
+    def send_bulk(self, template, prepared, recipients, default_data):
+        """
+        Send up to SES_BULK_LIMIT recipients in one call; returns a boolean
+        per recipient. prepared is the name prepare() returned.
+        """
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client().send_bulk_templated_email(
+                Source=current_app.config.get('SES_SENDER_EMAIL'),
+                Template=prepared,
+                DefaultTemplateData=json.dumps(default_data, default=str),
+                Destinations=[
+                    {
+                        'Destination': {'ToAddresses': [to]},
+                        'ReplacementTemplateData': json.dumps(data, default=str)
+                    }
+                    for to, data in recipients
+                ]
+            )
+        except ClientError as e:
+            logger.error(f"Bulk send of {template.name} failed: {e.response['Error']['Message']}")
+            return [False] * len(recipients)
+        except Exception as e:
+            logger.error(f"Unexpected error in bulk send of {template.name}: {str(e)}")
+            return [False] * len(recipients)
+        results = []
+        for (to, _), status in zip(recipients, response['Status']):
+            ok = status.get('Status') == 'Success'
+            if not ok:
+                logger.error(f"Failed to send email to {to}: {status.get('Error')}")
+            results.append(ok)
+        return results
+
+
+BACKENDS = {
+    'log': LogBackend,
+    'ses': SESBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Return the process-wide backend for the current configuration: the log
+    backend while MAIL_ENABLED is off, otherwise MAIL_BACKEND.
     """
+    config = current_app.config
+    name = config.get('MAIL_BACKEND', 'ses') if config.get('MAIL_ENABLED') else 'log'
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = _backends[name] = (BACKENDS.get(name) or import_string(name))()
+    return backend
 
-    body_text = f"""
-Ticket Allocation Update
 
-Hi {user.name},
+def send_email(to, subject, body_html, body_text=None):
+    """
+    Send an email through the configured backend.
 
-{message_text}
+    If MAIL_ENABLED is False, logs the email instead of sending.
+    Returns True on success, False on failure.
+    """
+    start = time.perf_counter()
+    ok = get_backend().send(to, subject, body_html, body_text)
+    metrics.record_email('single', int(ok), int(not ok), time.perf_counter() - start)
+    return ok
 
-Event: {event.name}
-Date: {event.event_date}
 
-{f'View event details: {event_url}' if event_url else ''}
+def send_bulk(template, recipients, default_data=None):
+    """
+    Send one template to many recipients, using templated bulk sends when
+    the backend has them.
 
-Thanks,
-{app_name}
+    recipients is a list of (to, data) pairs; data is merged over
+    default_data for that recipient. Returns a list of booleans, one per
+    recipient, indicating success.
     """
+    backend = get_backend()
+    default_data = default_data or {}
+
+    if not backend.bulk:
+        # Counted one by one by send_email
+        return [
+            send_email(to, *template.render({**default_data, **data}))
+            for to, data in recipients
+        ]
+
+    try:
+        prepared = backend.prepare(template)
+    except Exception as e:
+        logger.error(f"Could not prepare template {template.name}: {str(e)}")
+        metrics.record_email('bulk', 0, len(recipients), 0.0)
+        return [False] * len(recipients)
+
+    results = []
+    for start in range(0, len(recipients), SES_BULK_LIMIT):
+        chunk = recipients[start:start + SES_BULK_LIMIT]
+        started = time.perf_counter()
+        chunk_results = backend.send_bulk(template, prepared, chunk, default_data)
+        results.extend(chunk_results)
+        sent = sum(chunk_results)
+        metrics.record_email('bulk', sent, len(chunk) - sent, time.perf_counter() - started)
+    return results
+
+
+def send_magic_link_email(user, login_url):
+    """Send a magic link login email to the user."""
+    app_name = current_app.config.get('APP_NAME', 'Ticket Allocation')
+    message = MAGIC_LINK_TEMPLATE.render({'app_name': app_name, 'name': user.name, 'login_url': login_url})
+    return send_email(user.email, *message)
+
+
+def compose_welcome_email(name, login_url):
+    """Build the subject, HTML and text bodies of a welcome email."""
+    app_name = current_app.config.get('APP_NAME', 'Ticket Allocation')
+    return WELCOME_TEMPLATE.render({'app_name': app_name, 'name': name, 'login_url': login_url})
+
+
+def send_welcome_email(user, login_url):
+    """Send a welcome email to a new user with their first login link."""
+    return send_email(user.email, *compose_welcome_email(user.name, login_url))
+
+
+def _allocation_event_data(event):
+    """Template data shared by every allocation email for an event."""
+    app_url = current_app.config.get('APP_URL', '')
+    return {
+        'app_name': current_app.config.get('APP_NAME', 'Ticket Pool'),
+        'event_name': event.name,
+        'event_date': event.event_date,
+        'event_url': f"{app_url}/events/{event.id}" if app_url else ''
+    }
+
+
+def _allocation_recipient_data(name, requested_tickets, allocated_tickets):
+    return {
+        'name': name,
+        'requested': requested_tickets,
+        'requested_word': "ticket" if requested_tickets == 1 else "tickets",
+        'allocated': allocated_tickets,
+        'allocated_word': "ticket" if allocated_tickets == 1 else "tickets"
+    }
+
+
+def _allocation_template(allocated_tickets):
+    return ALLOCATION_GRANTED_TEMPLATE if allocated_tickets > 0 else ALLOCATION_NONE_TEMPLATE
+
+
+def compose_allocation_email(name, event, requested_tickets, allocated_tickets):
+    """Build the subject, HTML and text bodies of an allocation email."""
+    data = _allocation_event_data(event)
+    data.update(_allocation_recipient_data(name, requested_tickets, allocated_tickets))
+    return _allocation_template(allocated_tickets).render(data)
+
+
+def send_allocation_email(user, event, requested_tickets, allocated_tickets):
+    """Send an email notifying a user of their ticket allocation."""
+    message = compose_allocation_email(user.name, event, requested_tickets, allocated_tickets)
+    return send_email(user.email, *message)
+
+
+def queue_allocation_emails(event, recipients, db=None):
+    """
+    Queue allocation emails for a whole event's participants.
+
+    recipients is an iterable of (name, email, requested, allocated) tuples.
+    Messages are grouped by template, so the outbox worker can deliver each
+    group with templated bulk sends. db is passed to outbox.enqueue_template
+    to queue inside the caller's transaction. Returns the number queued.
+    """
+    groups = {}
+    for name, email, requested, allocated in recipients:
+        template = _allocation_template(allocated)
+        groups.setdefault(template, []).append(
+            (email, _allocation_recipient_data(name, requested, allocated))
+        )
 
-    return send_email(user.email, subject, body_html, body_text)
+    default_data = _allocation_event_data(event)
+    return sum(
+        outbox.enqueue_template(template, group, default_data, db=db)
+        for template, group in groups.items()
+    )
@@ -0,0 +1,100 @@
+"""
+Streaming CSV / JSON Lines export of submissions and allocations.
+
+Rows are read from a SQLite cursor and written out in small batches as the
+response is sent, so memory use stays flat however many submissions an
+export covers.
+"""
+
+import csv
+import io
+import json
+from datetime import timedelta
+from flask import Response, stream_with_context
+from app.db import get_db
+
+COLUMNS = ('event_id', 'event_name', 'event_date', 'event_status', 'user_name', 'user_email',
+           'preferences', 'first_choice', 'min_acceptable', 'allocated')
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson'
+}
+
+# Rows written per chunk sent to the client
+BATCH_SIZE = 500
+
+_SELECT = '''SELECT e.id, e.name, e.event_date, e.status, u.name, u.email,
+                    s.preferences, s.first_choice, s.min_acceptable, s.allocated
+             FROM events e
+             JOIN submissions s ON s.event_id = e.id
+             JOIN users u ON u.id = s.user_id'''
+
+# Spreadsheets treat cells starting with these as formulas
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def iter_event_rows(event_id):
+    """Yield one tuple of COLUMNS per submission to an event."""
+    return _iter_rows(f'{_SELECT} WHERE e.id = ? ORDER BY s.id', (event_id,))
+
+
+def iter_range_rows(start, end):
+    """Yield submissions to every event dated from start to end (dates, inclusive)."""
+    return _iter_rows(
+        f'''{_SELECT} WHERE e.event_date >= ? AND e.event_date < ?
+            ORDER BY e.event_date, e.id, s.id''',
+        (start.isoformat(), (end + timedelta(days=1)).isoformat())
+    )
+
+
+def _iter_rows(query, params):
+    cursor = get_db().cursor()
+    cursor.row_factory = None  # Plain tuples; no per-row sqlite3.Row
+    try:
+        cursor.execute(query, params)
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def _csv_safe(value):
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_csv_safe(value) for value in row])
+        if count % BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _jsonl_chunks(rows):
+    lines = []
+    for row in rows:
+        record = dict(zip(COLUMNS, row))
+        record['preferences'] = [int(p) for p in record['preferences'].split(',')]
+        lines.append(json.dumps(record, separators=(',', ':'), default=str))
+        if len(lines) == BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def export_response(rows, fmt, filename):
+    """Stream rows as a downloadable CSV or JSON Lines response."""
+    chunks = _csv_chunks(rows) if fmt == 'csv' else _jsonl_chunks(rows)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'}
+    )
@@ -1,6 +1,8 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, BooleanField, IntegerField, TextAreaField, DateTimeLocalField, SelectField, HiddenField
 from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional, ValidationError
+from app.models import MAX_PREFERENCE
 
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -10,6 +12,10 @@ class AdminCreateUserForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
     is_admin = BooleanField('Administrator')
 
+class UserImportForm(FlaskForm):
+    csv_file = FileField('CSV File', validators=[FileRequired(), FileAllowed(['csv', 'txt'], 'Upload a .csv file.')])
+    send_welcome = BooleanField('Send welcome emails', default=True)
+
 class UserForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired(), Length(min=2, max=100)])
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -30,18 +36,21 @@ class SubmissionForm(FlaskForm):
     def validate_preferences(self, field):
         if not field.data:
             raise ValidationError('Please select your ticket preferences.')
+        # ValidationError is a ValueError, so only the parsing goes in the try
         try:
             prefs = [int(x) for x in field.data.split(',')]
-            if not prefs or prefs[0] == 0:
-                raise ValidationError('Please select at least one ticket preference.')
-            # Verify preferences are in descending order and end with 0
-            for i in range(1, len(prefs)):
-                if prefs[i] >= prefs[i-1]:
-                    raise ValidationError('Each choice must be less than the previous.')
-            if prefs[-1] != 0:
-                raise ValidationError('Preferences must end with 0.')
         except ValueError:
             raise ValidationError('Invalid preference format.')
+        if not prefs or prefs[0] == 0:
+            raise ValidationError('Please select at least one ticket preference.')
+        if prefs[0] > MAX_PREFERENCE:
+            raise ValidationError(f'You can request at most {MAX_PREFERENCE} tickets.')
+        # Verify preferences are in descending order and end with 0
+        for i in range(1, len(prefs)):
+            if prefs[i] >= prefs[i-1]:
+                raise ValidationError('Each choice must be less than the previous.')
+        if prefs[-1] != 0:
+            raise ValidationError('Preferences must end with 0.')
 
 class CreatorSubmissionForm(FlaskForm):
     user_id = SelectField('Employee', validators=[DataRequired()], coerce=int)
@@ -51,14 +60,17 @@ class CreatorSubmissionForm(FlaskForm):
     def validate_preferences(self, field):
         if not field.data:
             raise ValidationError('Please select ticket preferences.')
+        # ValidationError is a ValueError, so only the parsing goes in the try
         try:
             prefs = [int(x) for x in field.data.split(',')]
-            if not prefs or prefs[0] == 0:
-                raise ValidationError('Please select at least one ticket preference.')
-            for i in range(1, len(prefs)):
-                if prefs[i] >= prefs[i-1]:
-                    raise ValidationError('Each choice must be less than the previous.')
-            if prefs[-1] != 0:
-                raise ValidationError('Preferences must end with 0.')
         except ValueError:
             raise ValidationError('Invalid preference format.')
+        if not prefs or prefs[0] == 0:
+            raise ValidationError('Please select at least one ticket preference.')
+        if prefs[0] > MAX_PREFERENCE:
+            raise ValidationError(f'You can request at most {MAX_PREFERENCE} tickets.')
+        for i in range(1, len(prefs)):
+            if prefs[i] >= prefs[i-1]:
+                raise ValidationError('Each choice must be less than the previous.')
+        if prefs[-1] != 0:
+            raise ValidationError('Preferences must end with 0.')
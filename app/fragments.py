@@ -0,0 +1,41 @@
+"""
+Versioned cache for rendered template fragments.
+
+Event cards and table rows are rendered once per (fragment, event id,
+event version) and reused across users and requests. The version comes
+from event_stats and changes on every write that could alter the output,
+so stale entries are never served; they simply age out of the LRU.
+
+In a template:
+
+    {% call cached_fragment('dashboard-card', event.id, stats.version) %}
+        ...markup that depends only on the event...
+    {% endcall %}
+
+Anything that differs per user must stay outside the call block.
+"""
+
+from markupsafe import Markup
+
+from app.cache import LRUCache
+
+fragment_cache = LRUCache(maxsize=4096, maxbytes=8 * 1024 * 1024)
+
+
+def cached_fragment(name, event_id, version, caller):
+    """Return the cached markup for a fragment, rendering it on a miss."""
+    if version is None:
+        return caller()
+    key = (name, event_id, version)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(caller())
+        fragment_cache.set(key, html)
+    return html
+
+
+def init_fragment_cache(app):
+    """Apply the app's fragment cache limits and expose it to templates."""
+    fragment_cache.configure(maxsize=app.config.get('FRAGMENT_CACHE_SIZE', 4096),
+                             maxbytes=app.config.get('FRAGMENT_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+    app.jinja_env.globals['cached_fragment'] = cached_fragment
@@ -0,0 +1,228 @@
+"""
+Per-request SQL instrumentation.
+
+When SQL_INSTRUMENTATION is on, get_db() hands out an InstrumentedConnection
+that times every statement (execute plus fetches) into the current
+request's QueryStats. After each request the totals go out as a
+Server-Timing header and one JSON log line with the slowest statements.
+
+Views can declare how many statements they should need with
+@query_budget(n), or through the SQL_QUERY_BUDGETS config mapping of
+endpoint -> n. Going over budget logs a warning, or raises
+QueryBudgetExceeded when SQL_QUERY_BUDGET_MODE is 'raise' (for tests).
+"""
+
+import json
+import logging
+import re
+import sqlite3
+import time
+from flask import current_app, g, request
+
+logger = logging.getLogger(__name__)
+
+# Statements kept per request for the slowest-statements report; past this
+# only the count and total time grow
+MAX_RECORDED_STATEMENTS = 1000
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryStats:
+    """Statements run during one request: count, total time and each statement's time."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.statements = []  # [seconds, sql]
+
+    def start(self, sql):
+        """Record a new statement; returns the entry later fetches add their time to."""
+        self.count += 1
+        entry = [0.0, sql]
+        if len(self.statements) < MAX_RECORDED_STATEMENTS:
+            self.statements.append(entry)
+        return entry
+
+    def add(self, entry, seconds):
+        entry[0] += seconds
+        self.total += seconds
+
+    def slowest(self, n):
+        """The n slowest statements as (milliseconds, sql) with whitespace collapsed."""
+        top = sorted(self.statements, key=lambda entry: entry[0], reverse=True)[:n]
+        return [(round(seconds * 1000, 3), _WHITESPACE.sub(' ', sql).strip()[:300])
+                for seconds, sql in top]
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor that reports its statements to connection.stats, if set."""
+
+    _entry = None
+
+    def _timed(self, sql, method, *args):
+        stats = self.connection.stats
+        if stats is None:
+            return method(*args)
+        self._entry = stats.start(sql)
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            stats.add(self._entry, time.perf_counter() - start)
+
+    def _fetch(self, method, *args):
+        stats = self.connection.stats
+        if stats is None or self._entry is None:
+            return method(*args)
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            stats.add(self._entry, time.perf_counter() - start)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(sql, super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._timed(sql_script, super().executescript, sql_script)
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    A connection whose statements are timed into self.stats.
+
+    sqlite3.Connection.execute() and friends don't go through cursor(), so
+    they are redirected here. Iterating a cursor row by row isn't timed;
+    the models fetch with fetchone()/fetchall().
+    """
+
+    stats = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        stats = self.stats
+        if stats is None or not self.in_transaction:
+            return super().commit()
+        entry = stats.start('COMMIT')
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            stats.add(entry, time.perf_counter() - start)
+
+
+def query_budget(limit):
+    """Declare the most SQL statements a view should run per request."""
+    def decorator(f):
+        # functools.wraps copies __dict__, so this survives login_required et al.
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+def attach(db):
+    """Start recording the current request's statements on db (called by get_db)."""
+    if isinstance(db, InstrumentedConnection):
+        stats = g.get('sql_stats')
+        if stats is None:
+            stats = g.sql_stats = QueryStats()
+        db.stats = stats
+
+
+def detach(db):
+    if isinstance(db, InstrumentedConnection):
+        db.stats = None
+
+
+def _budget():
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    if budget is None:
+        budget = current_app.config.get('SQL_QUERY_BUDGETS', {}).get(request.endpoint)
+    return budget
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _add_server_timing(response):
+    stats = g.get('sql_stats')
+    if stats is None:
+        return response
+    timing = f'db;dur={stats.total * 1000:.2f};desc="{stats.count} queries"'
+    started = g.get('request_started')
+    if started is not None:
+        timing += f', app;dur={(time.perf_counter() - started) * 1000:.2f}'
+    response.headers.add('Server-Timing', timing)
+    g.response_status = response.status_code
+
+    budget = _budget()
+    if budget is not None and stats.count > budget:
+        g.sql_over_budget = budget
+        if current_app.config.get('SQL_QUERY_BUDGET_MODE') == 'raise':
+            statements = '\n'.join(_WHITESPACE.sub(' ', sql).strip()[:300] for _, sql in stats.statements)
+            raise QueryBudgetExceeded(
+                f'{request.endpoint} ran {stats.count} queries (budget {budget}):\n{statements}')
+    return response
+
+
+def _log_request(exc=None):
+    stats = g.get('sql_stats')
+    if stats is None:
+        return
+    over_budget = g.get('sql_over_budget')
+    started = g.get('request_started')
+    record = {
+        'event': 'sql',
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': g.get('response_status'),
+        'queries': stats.count,
+        'sql_ms': round(stats.total * 1000, 2),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2) if started else None,
+        'slowest': [{'ms': ms, 'sql': sql}
+                    for ms, sql in stats.slowest(current_app.config.get('SQL_SLOW_STATEMENTS', 3))]
+    }
+    if over_budget is not None:
+        record['budget'] = over_budget
+        logger.warning(json.dumps(record))
+    else:
+        logger.info(json.dumps(record))
+
+
+def init_app(app):
+    if not app.config.get('SQL_INSTRUMENTATION'):
+        return
+    app.before_request(_start_timer)
+    app.after_request(_add_server_timing)
+    app.teardown_request(_log_request)
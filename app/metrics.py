@@ -0,0 +1,302 @@
+"""
+Request, email and database metrics in Prometheus text format.
+
+Each process records into the module-level registry. With METRICS_DIR set,
+a background thread writes the process's totals to
+METRICS_DIR/metrics-<pid>-<token>.json every METRICS_FLUSH_INTERVAL
+seconds, and the /admin/metrics endpoint sums every file it finds, so one
+scrape covers all gunicorn workers. gunicorn.conf.py calls remove_files()
+when a worker exits and when the master starts, so the totals cover live
+workers only; Prometheus reads the drop as a counter reset. Gauges from a
+file whose process is gone are skipped until then. Without METRICS_DIR the
+endpoint reports the answering worker only.
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from flask import g, request
+
+# name -> (type, help, label names, histogram buckets)
+METRICS = {
+    'http_requests_total': (
+        'counter', 'Requests handled, by endpoint, method and status.',
+        ('endpoint', 'method', 'status'), None),
+    'http_request_duration_seconds': (
+        'histogram', 'Time from the start of a request until its response finished streaming.',
+        ('endpoint',), (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)),
+    'http_requests_in_flight': (
+        'gauge', 'Requests currently being handled.',
+        ('endpoint',), None),
+    'db_queries_total': (
+        'counter', 'SQL statements run while handling requests.',
+        ('endpoint',), None),
+    'db_duration_seconds': (
+        'histogram', 'SQL time per request.',
+        ('endpoint',), (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)),
+    'login_rate_limited_total': (
+        'counter', 'Login requests rejected by the rate limiter, by the limit they hit.',
+        ('limit',), None),
+    'email_sent_total': (
+        'counter', 'Emails accepted for delivery.',
+        ('method',), None),
+    'email_failed_total': (
+        'counter', 'Emails that failed to send.',
+        ('method',), None),
+    'email_send_duration_seconds': (
+        'histogram', 'Time spent in a single send or one bulk send call.',
+        ('method',), (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)),
+}
+
+PREFIX = 'ticket_pool_'
+
+# Label for requests that didn't match a route, so 404 probes can't add series
+UNMATCHED = '<unmatched>'
+
+
+class Registry:
+    """Thread-safe counters, gauges and histograms for one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # (name, labels) -> number, or [bucket counts..., sum, count]
+        self.changed = False
+
+    def inc(self, name, labels=(), value=1):
+        """Add to a counter or gauge; labels are values in METRICS label order."""
+        key = (name, tuple(str(label) for label in labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+            self.changed = True
+
+    def observe(self, name, value, labels=()):
+        buckets = METRICS[name][3]
+        key = (name, tuple(str(label) for label in labels))
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(buckets) + 3)
+            # series[i] counts observations in bucket i only; render() accumulates
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+            self.changed = True
+
+    def snapshot(self):
+        """This process's values as JSON-friendly [[name, labels, value], ...]."""
+        with self._lock:
+            return [[name, list(labels), list(value) if isinstance(value, list) else value]
+                    for (name, labels), value in self._values.items()]
+
+
+registry = Registry()
+
+_directory = None
+_interval = 5.0
+_token = uuid.uuid4().hex[:8]
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _path():
+    return os.path.join(_directory, f'metrics-{os.getpid()}-{_token}.json')
+
+
+def flush():
+    """Write this process's snapshot to METRICS_DIR (atomically)."""
+    if not _directory:
+        return
+    path = _path()
+    tmp = f'{path}.tmp'
+    registry.changed = False
+    with open(tmp, 'w') as f:
+        json.dump({'pid': os.getpid(), 'values': registry.snapshot()}, f)
+    os.replace(tmp, path)
+
+
+def remove_files(directory, pid=None):
+    """
+    Delete the metric files of process pid, or all of them, from directory.
+
+    Runs in the gunicorn master (see gunicorn.conf.py): for an exited worker,
+    and for the whole directory on start so a restart begins from zero.
+    """
+    pattern = f'metrics-{pid}-*.json*' if pid is not None else 'metrics-*.json*'
+    for path in glob.glob(os.path.join(directory, pattern)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _flush_loop():
+    while True:
+        time.sleep(_interval)
+        if registry.changed:
+            try:
+                flush()
+            except OSError:
+                pass
+
+
+def _ensure_flusher():
+    """Start the flush thread once per process (fork-safe), if METRICS_DIR is set."""
+    global _flusher_pid, _token
+    if not _directory or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            if _flusher_pid is not None:
+                # Forked from a process that already recorded; don't share its file
+                _token = uuid.uuid4().hex[:8]
+            threading.Thread(target=_flush_loop, daemon=True,
+                             name='metrics-flush').start()
+            _flusher_pid = os.getpid()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Every process's values merged: {(name, labels): value}."""
+    snapshots = [(os.getpid(), registry.snapshot())]
+    if _directory:
+        own = _path()
+        for path in glob.glob(os.path.join(_directory, 'metrics-*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((data['pid'], data['values']))
+
+    merged = {}
+    for pid, values in snapshots:
+        alive = None
+        for name, labels, value in values:
+            if name not in METRICS:
+                continue
+            if METRICS[name][0] == 'gauge':
+                if alive is None:
+                    alive = pid == os.getpid() or _alive(pid)
+                if not alive:
+                    continue
+            key = (name, tuple(labels))
+            if isinstance(value, list):
+                current = merged.get(key)
+                merged[key] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    merged = collect()
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        full = PREFIX + name
+        lines.append(f'# HELP {full} {help_text}')
+        lines.append(f'# TYPE {full} {kind}')
+        for (series_name, labels), value in sorted(merged.items()):
+            if series_name != name:
+                continue
+            if kind != 'histogram':
+                lines.append(f'{full}{_labels(label_names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f'{full}_bucket{_labels(label_names, labels, [("le", repr(bound))])} {cumulative}')
+            lines.append(f'{full}_bucket{_labels(label_names, labels, [("le", "+Inf")])} {value[-1]}')
+            lines.append(f'{full}_sum{_labels(label_names, labels)} {_number(value[-2])}')
+            lines.append(f'{full}_count{_labels(label_names, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def record_email(method, sent, failed, seconds):
+    """Count one send_email / send_bulk call (see app/email.py)."""
+    _ensure_flusher()
+    if sent:
+        registry.inc('email_sent_total', (method,), sent)
+    if failed:
+        registry.inc('email_failed_total', (method,), failed)
+    registry.observe('email_send_duration_seconds', seconds, (method,))
+
+
+def _endpoint():
+    return request.endpoint or UNMATCHED
+
+
+def _start_request():
+    _ensure_flusher()
+    g.metrics_started = time.perf_counter()
+    g.metrics_endpoint = _endpoint()
+    registry.inc('http_requests_in_flight', (g.metrics_endpoint,))
+
+
+def _record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _finish_request(exc=None):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    endpoint = g.metrics_endpoint
+    registry.inc('http_requests_in_flight', (endpoint,), -1)
+    status = g.get('metrics_status', 500 if exc else 200)
+    registry.inc('http_requests_total', (endpoint, request.method, status))
+    registry.observe('http_request_duration_seconds', time.perf_counter() - started, (endpoint,))
+
+    # Filled in by app.instrumentation when SQL_INSTRUMENTATION is on
+    stats = g.get('sql_stats')
+    if stats is not None:
+        registry.inc('db_queries_total', (endpoint,), stats.count)
+        registry.observe('db_duration_seconds', stats.total, (endpoint,))
+
+
+def init_app(app):
+    global _directory, _interval
+    if not app.config.get('METRICS_ENABLED'):
+        return
+    directory = app.config.get('METRICS_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        _directory = directory
+        _interval = app.config.get('METRICS_FLUSH_INTERVAL', 5.0)
+        atexit.register(lambda: registry.changed and flush())
+
+    app.before_request(_start_request)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_request)
@@ -1,12 +1,117 @@
-from flask_login import UserMixin
 from app.db import get_db
 from app import login_manager
+from app.cache import LRUCache
+from app.coherence import tracker
+from app.pagination import Page, encode_cursor, decode_cursor
+from app.pubsub import broker, event_channel
 import secrets
 import hashlib
-from datetime import datetime, timedelta
-
-class User(UserMixin):
-    def __init__(self, id, name, email, password_hash=None, is_admin=False, is_active=True, must_reset_password=False, reset_token=None, reset_token_expires=None, created_at=None):
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+# Magic-link lifetime, and how often (per process) used and expired tokens are deleted
+LOGIN_TOKEN_LIFETIME = timedelta(minutes=15)
+LOGIN_TOKEN_PURGE_INTERVAL = 3600  # seconds
+_last_token_purge = 0.0
+
+# Users loaded by the Flask-Login user_loader, keyed by (id, 'users' version)
+user_cache = LRUCache(maxsize=1024, ttl=300)
+tracker.register('users', user_cache)
+
+# Event listings, keyed by the 'events' version they were read at (see _cached_listing)
+event_cache = LRUCache(maxsize=256)
+tracker.register('events', event_cache)
+
+
+def _select(cls, query, params=()):
+    """
+    Run a query and build cls instances straight from the result tuples.
+
+    The query must select cls.COLUMNS (plus any extra constructor arguments)
+    in constructor order; no intermediate dict or sqlite3.Row is created.
+    """
+    cursor = get_db().cursor()
+    cursor.row_factory = lambda _cursor, row: cls(*row)
+    return cursor.execute(query, params)
+
+
+def _publish(event_id, kind, data):
+    """
+    Publish a change to live streams watching event_id (see app/pubsub.py).
+
+    The event's current totals and version ride along with every message.
+    Does nothing, and runs no queries, when nobody is subscribed.
+    """
+    channel = event_channel(event_id)
+    if not broker.has_subscribers(channel):
+        return
+    row = get_db().execute(
+        '''SELECT submission_count, total_first_choice, total_min, total_allocated, version
+           FROM event_stats WHERE event_id = ?''',
+        (event_id,)
+    ).fetchone()
+    if row:
+        data['stats'] = {key: row[key] for key in
+                         ('submission_count', 'total_first_choice', 'total_min', 'total_allocated')}
+        data['version'] = row['version']
+    broker.publish(channel, kind, data)
+
+
+def _keyset_page(cls, table, sort_column, where='', params=(), descending=False,
+                 after=None, before=None, per_page=50):
+    """
+    Fetch one page of cls ordered by (sort_column, id) using keyset pagination.
+
+    `after` and `before` are cursors from a previous Page; each query seeks
+    straight to the cursor through the (sort_column, id) index, so the cost
+    does not grow with the page number.
+    """
+    forward = before is None
+    key = decode_cursor(after if forward else before)
+    conditions = [where] if where else []
+    params = list(params)
+
+    # Walking forward through a descending list (or backward through an
+    # ascending one) means moving to smaller keys.
+    toward_smaller = descending == forward
+    if key is not None:
+        conditions.append(f'({sort_column}, id) {"<" if toward_smaller else ">"} (?, ?)')
+        params.extend(key)
+    order = 'DESC' if toward_smaller else 'ASC'
+
+    query = f'SELECT {cls.SELECT} FROM {table}'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += f' ORDER BY {sort_column} {order}, id {order} LIMIT ?'
+    params.append(per_page + 1)
+
+    items = _select(cls, query, params).fetchall()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if not forward:
+        items.reverse()
+
+    has_next = more if forward else True
+    has_prev = (key is not None) if forward else more
+    def cursor_for(item):
+        return encode_cursor((getattr(item, sort_column), item.id))
+
+    return Page(
+        items,
+        next_cursor=cursor_for(items[-1]) if items and has_next else None,
+        prev_cursor=cursor_for(items[0]) if items and has_prev else None
+    )
+
+
+class User:
+    # Implements the Flask-Login user interface directly; UserMixin has no
+    # __slots__ and would bring back a per-instance __dict__.
+    __slots__ = ('id', 'name', 'email', 'is_admin', '_is_active', 'created_at')
+    COLUMNS = ('id', 'name', 'email', 'is_admin', 'is_active', 'created_at')
+    SELECT = ', '.join(COLUMNS)
+
+    def __init__(self, id, name, email, is_admin=False, is_active=True, created_at=None):
         self.id = id
         self.name = name
         self.email = email
@@ -18,6 +123,30 @@ class User(UserMixin):
     def is_active(self):
         return self._is_active
 
+    @property
+    def is_authenticated(self):
+        return self.is_active
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return NotImplemented
+        return not equal
+
+    __hash__ = None
+
     @staticmethod
     def create(name, email, is_admin=False):
         """Create a new user."""
@@ -30,70 +159,126 @@ class User(UserMixin):
         db.commit()
         return cursor.lastrowid
 
+    @staticmethod
+    def bulk_create(users, send_interval=0.0, token_lifetime=LOGIN_TOKEN_LIFETIME, notify=None):
+        """
+        Create many users in one transaction, each with a login token.
+
+        users is a list of (name, email, is_admin) with emails already
+        normalized. Emails that already exist are skipped; the check is one
+        query inside the same write transaction, so it can't race another
+        import. Welcome emails are expected to go out send_interval seconds
+        apart, so each token expires token_lifetime after its own send time.
+        notify, if given, is called with the created users and the connection
+        to queue their welcome emails in the same transaction.
+
+        Returns a list of (name, email, token, send_at) for the created users.
+        """
+        db = get_db()
+        now = datetime.now()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            existing = {
+                row[0] for row in db.execute(
+                    'SELECT email FROM users WHERE email IN (SELECT value FROM json_each(?))',
+                    (json.dumps([email for _, email, _ in users]),)
+                )
+            }
+            created = []
+            rows = []
+            for name, email, is_admin in users:
+                if email in existing:
+                    continue
+                existing.add(email)
+                token = secrets.token_urlsafe(32)
+                send_at = now + timedelta(seconds=send_interval * len(created))
+                created.append((name, email, token, send_at))
+                rows.append((name, email, is_admin, _hash_token(token), send_at + token_lifetime))
+            db.executemany(
+                '''INSERT INTO users (name, email, is_admin, must_reset_password)
+                   VALUES (?, ?, ?, 0)''',
+                [(name, email, is_admin) for name, email, is_admin, _, _ in rows]
+            )
+            db.executemany(
+                '''INSERT INTO login_tokens (token_hash, user_id, expires_at)
+                   SELECT ?, id, ? FROM users WHERE email = ?''',
+                [(token_hash, expires, email) for _, email, _, token_hash, expires in rows]
+            )
+            if notify is not None and created:
+                notify(created, db)
+        return created
+
     @staticmethod
     def generate_login_token(user_id):
-        """Generate a magic link login token (15 min expiry)."""
+        """
+        Generate a magic link login token (15 min expiry).
+
+        Earlier tokens stay valid until they expire or are used, so a second
+        login request doesn't break the link from the first.
+        """
         db = get_db()
         token = secrets.token_urlsafe(32)
-        token_hash = hashlib.sha256(token.encode()).hexdigest()
-        expires = datetime.now() + timedelta(minutes=15)
         db.execute(
-            'UPDATE users SET reset_token = ?, reset_token_expires = ? WHERE id = ?',
-            (token_hash, expires, user_id)
+            'INSERT INTO login_tokens (token_hash, user_id, expires_at) VALUES (?, ?, ?)',
+            (_hash_token(token), user_id, datetime.now() + LOGIN_TOKEN_LIFETIME)
         )
         db.commit()
+        User._maybe_purge_login_tokens()
         return token
 
     @staticmethod
-    def get_by_login_token(token):
-        """Find a user by their login token if it's still valid."""
-        token_hash = hashlib.sha256(token.encode()).hexdigest()
+    def consume_login_token(token):
+        """
+        Use up a login token and return its user, or None if the token is
+        unknown, expired or already used.
+
+        Marking the token used and checking it are one statement, so two
+        clicks on the same link can't both log in.
+        """
         db = get_db()
         row = db.execute(
-            'SELECT * FROM users WHERE reset_token = ? AND reset_token_expires > ?',
-            (token_hash, datetime.now())
+            '''UPDATE login_tokens SET used_at = ?
+               WHERE token_hash = ? AND used_at IS NULL AND expires_at > ?
+               RETURNING user_id''',
+            (datetime.now(), _hash_token(token), datetime.now())
         ).fetchone()
-        if row:
-            return User(**dict(row))
-        return None
+        db.commit()
+        return User.get_by_id(row[0]) if row else None
 
     @staticmethod
-    def clear_login_token(user_id):
-        """Clear the login token after use (single-use)."""
+    def purge_login_tokens():
+        """Delete used and expired login tokens. Returns the number deleted."""
+        global _last_token_purge
         db = get_db()
-        db.execute(
-            'UPDATE users SET reset_token = NULL, reset_token_expires = NULL WHERE id = ?',
-            (user_id,)
+        cursor = db.execute(
+            'DELETE FROM login_tokens WHERE used_at IS NOT NULL OR expires_at <= ?',
+            (datetime.now(),)
         )
         db.commit()
+        _last_token_purge = time.monotonic()
+        return cursor.rowcount
+
+    @staticmethod
+    def _maybe_purge_login_tokens():
+        if time.monotonic() - _last_token_purge >= LOGIN_TOKEN_PURGE_INTERVAL:
+            User.purge_login_tokens()
 
     @staticmethod
     def get_by_id(user_id):
-        db = get_db()
-        row = db.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        if row:
-            return User(**dict(row))
-        return None
+        return _select(User, f'SELECT {User.SELECT} FROM users WHERE id = ?', (user_id,)).fetchone()
 
     @staticmethod
     def get_by_email(email):
-        db = get_db()
-        row = db.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
-        if row:
-            return User(**dict(row))
-        return None
+        return _select(User, f'SELECT {User.SELECT} FROM users WHERE email = ?', (email,)).fetchone()
 
     @staticmethod
-    def get_all():
-        db = get_db()
-        rows = db.execute('SELECT * FROM users ORDER BY name').fetchall()
-        return [User(**dict(row)) for row in rows]
+    def get_page(after=None, before=None, per_page=50):
+        """Get one page of users ordered by name."""
+        return _keyset_page(User, 'users', 'name', after=after, before=before, per_page=per_page)
 
     @staticmethod
     def get_all_active():
-        db = get_db()
-        rows = db.execute('SELECT * FROM users WHERE is_active = 1 ORDER BY name').fetchall()
-        return [User(**dict(row)) for row in rows]
+        return _select(User, f'SELECT {User.SELECT} FROM users WHERE is_active = 1 ORDER BY name').fetchall()
 
     @staticmethod
     def update(user_id, name=None, email=None, is_admin=None, is_active=None):
@@ -118,14 +303,59 @@ class User(UserMixin):
             params.append(user_id)
             db.execute(f'UPDATE users SET {", ".join(updates)} WHERE id = ?', params)
             db.commit()
+            # The write bumps the 'users' version, so cached copies are never served again
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get_by_id(int(user_id))
+    user_id = int(user_id)
+    # Keyed by the version synced at the start of the request, so a row read
+    # just before another worker changed it can't be served after that change
+    version = tracker.version('users')
+    if version is None:
+        return User.get_by_id(user_id)
+    key = (user_id, version)
+    user = user_cache.get(key)
+    if user is None:
+        user = User.get_by_id(user_id)
+        if user:
+            user_cache.set(key, user)
+    return user
+
+
+def init_user_cache(app):
+    """Apply the app's user cache limits."""
+    user_cache.configure(maxsize=app.config.get('USER_CACHE_SIZE', 1024),
+                         ttl=app.config.get('USER_CACHE_TTL', 300))
+    event_cache.configure(maxsize=app.config.get('EVENT_CACHE_SIZE', 256))
+
+
+def _cached_listing(key, load):
+    """
+    Return load() through event_cache, keyed by the request's 'events' version.
+
+    Every event or submission write bumps that version, so a cached listing
+    is only served while nothing it could contain has changed. Outside a
+    request, or after the request wrote, load() runs uncached.
+    """
+    version = tracker.version('events')
+    if version is None:
+        return load()
+    key = (key, version)
+    value = event_cache.get(key)
+    if value is None:
+        value = load()
+        event_cache.set(key, value)
+    # Callers may append to or sort the list
+    return list(value) if isinstance(value, list) else value
 
 
 class Event:
+    __slots__ = ('id', 'name', 'event_date', 'total_tickets', 'notes', 'status',
+                 'created_by', 'created_at', 'finalized_at')
+    COLUMNS = __slots__
+    SELECT = ', '.join(COLUMNS)
+
     def __init__(self, id, name, event_date, total_tickets, notes, status, created_by, created_at, finalized_at=None):
         self.id = id
         self.name = name
@@ -160,50 +390,155 @@ class Event:
 
     @staticmethod
     def get_by_id(event_id):
-        db = get_db()
-        row = db.execute('SELECT * FROM events WHERE id = ?', (event_id,)).fetchone()
-        if row:
-            return Event(**dict(row))
-        return None
+        return _select(Event, f'SELECT {Event.SELECT} FROM events WHERE id = ?', (event_id,)).fetchone()
 
     @staticmethod
     def get_all_open():
-        db = get_db()
-        rows = db.execute(
-            'SELECT * FROM events WHERE status = ? ORDER BY event_date ASC',
+        return _cached_listing('open', lambda: _select(
+            Event,
+            f'SELECT {Event.SELECT} FROM events WHERE status = ? ORDER BY event_date ASC',
             ('open',)
-        ).fetchall()
-        return [Event(**dict(row)) for row in rows]
+        ).fetchall())
 
     @staticmethod
     def get_all_past(limit=None):
-        db = get_db()
-        query = '''SELECT * FROM events
-                   WHERE status IN ('finalized', 'cancelled')
-                   ORDER BY event_date DESC'''
+        query = f'''SELECT {Event.SELECT} FROM events
+                    WHERE status IN ('finalized', 'cancelled')
+                    ORDER BY event_date DESC'''
+        params = ()
         if limit:
-            query += f' LIMIT {limit}'
-        rows = db.execute(query).fetchall()
-        return [Event(**dict(row)) for row in rows]
+            query += ' LIMIT ?'
+            params = (limit,)
+        return _cached_listing(('past', limit), lambda: _select(Event, query, params).fetchall())
+
+    @staticmethod
+    def get_past_events_page(months=24, after=None, before=None, per_page=50):
+        """Get one page of past events from the last N months, newest first."""
+        # Unary + keeps SQLite off idx_events_status so it walks
+        # idx_events_date_id in order and stops after one page
+        return _keyset_page(
+            Event, 'events', 'event_date',
+            where="+status IN ('finalized', 'cancelled') AND event_date >= date('now', ?)",
+            params=(f'-{months} months',),
+            descending=True, after=after, before=before, per_page=per_page
+        )
+
+    @staticmethod
+    def count_past_events_within_months(months=24):
+        """Count past events from the last N months."""
+        def count():
+            return get_db().execute(
+                '''SELECT COUNT(*) FROM events
+                   WHERE status IN ('finalized', 'cancelled')
+                   AND event_date >= date('now', ?)''',
+                (f'-{months} months',)
+            ).fetchone()[0]
+        # The window moves with SQLite's (UTC) date
+        return _cached_listing(('past-count', months, datetime.now(timezone.utc).date()), count)
+
+    @staticmethod
+    def get_page(after=None, before=None, per_page=50):
+        """Get one page of all events, newest first."""
+        return _keyset_page(Event, 'events', 'event_date', descending=True,
+                            after=after, before=before, per_page=per_page)
 
     @staticmethod
-    def get_past_events_within_months(months=24):
-        """Get past events from the last N months."""
+    def get_stats(event_id):
+        """Get the maintained aggregate stats for a single event."""
         db = get_db()
-        rows = db.execute(
-            '''SELECT * FROM events
-               WHERE status IN ('finalized', 'cancelled')
-               AND event_date >= date('now', ?)
-               ORDER BY event_date DESC''',
-            (f'-{months} months',)
-        ).fetchall()
-        return [Event(**dict(row)) for row in rows]
+        row = db.execute(
+            '''SELECT submission_count, total_first_choice, total_min, total_allocated
+               FROM event_stats WHERE event_id = ?''',
+            (event_id,)
+        ).fetchone()
+        if row:
+            return dict(row)
+        return {'submission_count': 0, 'total_first_choice': 0, 'total_min': 0, 'total_allocated': 0}
 
     @staticmethod
-    def get_all():
+    def get_version(event_id):
+        """
+        Get (version, modified_at) for an event, or None if it doesn't exist.
+
+        The version changes whenever the event, its submissions or the names
+        shown alongside them change; modified_at is when that last happened.
+        """
         db = get_db()
-        rows = db.execute('SELECT * FROM events ORDER BY event_date DESC').fetchall()
-        return [Event(**dict(row)) for row in rows]
+        row = db.execute(
+            'SELECT version, modified_at FROM event_stats WHERE event_id = ?',
+            (event_id,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    @staticmethod
+    def get_listing_version():
+        """
+        Get (generation, modified_at) covering every event.
+
+        The generation changes on any change to any event or submission, so
+        it validates pages that list many events.
+        """
+        generation = tracker.version('events')
+        if generation is not None:
+            return generation, _cached_listing('modified_at', Event._max_modified_at)
+        db = get_db()
+        generation = db.execute(
+            "SELECT version FROM cache_versions WHERE namespace = 'events'"
+        ).fetchone()
+        return (generation[0] if generation else 0), Event._max_modified_at()
+
+    @staticmethod
+    def _max_modified_at():
+        return get_db().execute('SELECT MAX(modified_at) FROM event_stats').fetchone()[0]
+
+    @staticmethod
+    def get_stats_for_events(event_ids, user_id=None):
+        """
+        Get aggregate stats for many events in a single query.
+
+        Returns a dict keyed by event id with submission_count, total_requested
+        (sum of first choices), total_min, total_allocated, creator_name,
+        version (see get_version) and user_submitted (whether user_id has a
+        submission for the event).
+        """
+        stats = {}
+        event_ids = list(event_ids)
+        if not event_ids:
+            return stats
+
+        db = get_db()
+        # Stay well below SQLite's bound-parameter limit on older builds
+        chunk_size = 500
+        for start in range(0, len(event_ids), chunk_size):
+            chunk = event_ids[start:start + chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = db.execute(
+                f'''SELECT e.id,
+                          u.name AS creator_name,
+                          COALESCE(st.submission_count, 0) AS submission_count,
+                          COALESCE(st.total_first_choice, 0) AS total_requested,
+                          COALESCE(st.total_min, 0) AS total_min,
+                          COALESCE(st.total_allocated, 0) AS total_allocated,
+                          st.version,
+                          EXISTS(SELECT 1 FROM submissions s
+                                 WHERE s.event_id = e.id AND s.user_id = ?) AS user_submitted
+                   FROM events e
+                   LEFT JOIN users u ON u.id = e.created_by
+                   LEFT JOIN event_stats st ON st.event_id = e.id
+                   WHERE e.id IN ({placeholders})''',
+                (user_id, *chunk)
+            ).fetchall()
+            for row in rows:
+                stats[row['id']] = {
+                    'creator_name': row['creator_name'] or 'Unknown',
+                    'submission_count': row['submission_count'],
+                    'total_requested': row['total_requested'],
+                    'total_min': row['total_min'],
+                    'total_allocated': row['total_allocated'],
+                    'version': row['version'],
+                    'user_submitted': bool(row['user_submitted'])
+                }
+        return stats
 
     @staticmethod
     def update(event_id, **kwargs):
@@ -230,86 +565,127 @@ class Event:
         db.commit()
 
 
+def _hash_token(token):
+    """Only a SHA-256 of each login token is stored."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Largest ticket count a preference may name: tier_mask keeps one bit per
+# count and must fit SQLite's signed 64-bit INTEGER
+MAX_PREFERENCE = 62
+
+
+def encode_preferences(preferences):
+    """
+    Normalize preferences and derive the values stored alongside them.
+
+    Accepts a list like [4, 2, 1, 0] or a string like "4,2,1,0" and returns
+    (preferences_string, first_choice, min_acceptable, tier_mask), where bit
+    n of tier_mask is set when n tickets are acceptable. The forms reject
+    counts above MAX_PREFERENCE; any older rows with one leave it out of
+    the mask.
+    """
+    if isinstance(preferences, str):
+        prefs = [int(x) for x in preferences.split(',')] if preferences else []
+    else:
+        prefs = [int(p) for p in preferences]
+    non_zero = [p for p in prefs if p > 0]
+    tier_mask = 0
+    for p in non_zero:
+        if p <= MAX_PREFERENCE:
+            tier_mask |= 1 << p
+    return (
+        ','.join(str(p) for p in prefs),
+        prefs[0] if prefs else 0,
+        min(non_zero) if non_zero else 0,
+        tier_mask
+    )
+
+
 class Submission:
-    def __init__(self, id, event_id, user_id, preferences, notes, allocated, submitted_at, updated_at, **kwargs):
-        # **kwargs accepts and ignores any extra columns from old schema (ideal_tickets, min_tickets)
+    __slots__ = ('id', 'event_id', 'user_id', 'preferences', 'notes', 'allocated',
+                 'submitted_at', 'updated_at', 'first_choice', 'min_acceptable', 'tier_mask',
+                 'user_name', 'user_email')
+    COLUMNS = __slots__[:11]
+    SELECT = ', '.join(COLUMNS)
+    # Same columns qualified for joins against users
+    SELECT_JOINED = ', '.join('s.' + column for column in COLUMNS)
+
+    def __init__(self, id, event_id, user_id, preferences, notes, allocated, submitted_at, updated_at,
+                 first_choice=0, min_acceptable=0, tier_mask=0, user_name=None, user_email=None):
         self.id = id
         self.event_id = event_id
         self.user_id = user_id
         self.preferences = preferences  # Stored as comma-separated string: "4,2,1,0"
+        self.first_choice = first_choice  # First (ideal) choice
+        self.min_acceptable = min_acceptable  # Smallest non-zero choice
+        self.tier_mask = tier_mask
         self.notes = notes
         self.allocated = allocated
         self.submitted_at = submitted_at
         self.updated_at = updated_at
+        # Only set by queries that join users (get_all_for_event)
+        self.user_name = user_name
+        self.user_email = user_email
 
     @property
     def preferences_list(self):
-        """Return preferences as a list of integers."""
+        """
+        Return preferences as a list of integers, ending with 0.
+
+        Parsed from the stored string rather than tier_mask, which leaves out
+        counts above MAX_PREFERENCE and is only meant for allocation.
+        """
         if not self.preferences:
             return []
         return [int(x) for x in self.preferences.split(',')]
 
-    @property
-    def first_choice(self):
-        """Return the first (ideal) choice."""
-        prefs = self.preferences_list
-        return prefs[0] if prefs else 0
-
-    @property
-    def min_acceptable(self):
-        """Return the minimum acceptable (last non-zero value)."""
-        prefs = self.preferences_list
-        non_zero = [p for p in prefs if p > 0]
-        return min(non_zero) if non_zero else 0
-
     def get_user(self):
         return User.get_by_id(self.user_id)
 
     @staticmethod
     def create(event_id, user_id, preferences, notes=None):
         db = get_db()
-        # preferences should be a list like [4, 2, 1, 0] - convert to string
-        if isinstance(preferences, list):
-            preferences = ','.join(str(p) for p in preferences)
+        # preferences may be a list like [4, 2, 1, 0] or the string "4,2,1,0"
+        preferences, first_choice, min_acceptable, tier_mask = encode_preferences(preferences)
         cursor = db.execute(
-            '''INSERT INTO submissions (event_id, user_id, preferences, notes)
-               VALUES (?, ?, ?, ?)''',
-            (event_id, user_id, preferences, notes)
+            '''INSERT INTO submissions
+                   (event_id, user_id, preferences, first_choice, min_acceptable, tier_mask, notes)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (event_id, user_id, preferences, first_choice, min_acceptable, tier_mask, notes)
         )
         db.commit()
+        Submission._publish_change('submission.created', event_id, cursor.lastrowid)
         return cursor.lastrowid
 
     @staticmethod
     def get_by_id(submission_id):
-        db = get_db()
-        row = db.execute('SELECT * FROM submissions WHERE id = ?', (submission_id,)).fetchone()
-        if row:
-            return Submission(**dict(row))
-        return None
+        return _select(
+            Submission,
+            f'SELECT {Submission.SELECT} FROM submissions WHERE id = ?',
+            (submission_id,)
+        ).fetchone()
 
     @staticmethod
     def get_by_event_and_user(event_id, user_id):
-        db = get_db()
-        row = db.execute(
-            'SELECT * FROM submissions WHERE event_id = ? AND user_id = ?',
+        return _select(
+            Submission,
+            f'SELECT {Submission.SELECT} FROM submissions WHERE event_id = ? AND user_id = ?',
             (event_id, user_id)
         ).fetchone()
-        if row:
-            return Submission(**dict(row))
-        return None
 
     @staticmethod
     def get_all_for_event(event_id):
-        db = get_db()
-        rows = db.execute(
-            '''SELECT s.*, u.name as user_name
-               FROM submissions s
-               JOIN users u ON s.user_id = u.id
-               WHERE s.event_id = ?
-               ORDER BY u.name''',
+        """Get all submissions for an event with user_name/user_email set."""
+        return _select(
+            Submission,
+            f'''SELECT {Submission.SELECT_JOINED}, u.name, u.email
+                FROM submissions s
+                JOIN users u ON s.user_id = u.id
+                WHERE s.event_id = ?
+                ORDER BY u.name''',
             (event_id,)
         ).fetchall()
-        return [dict(row) for row in rows]
 
     @staticmethod
     def update(submission_id, preferences=None, notes=None):
@@ -318,29 +694,113 @@ class Submission:
         params = []
 
         if preferences is not None:
-            if isinstance(preferences, list):
-                preferences = ','.join(str(p) for p in preferences)
-            updates.append('preferences = ?')
-            params.append(preferences)
+            preferences, first_choice, min_acceptable, tier_mask = encode_preferences(preferences)
+            updates.append('preferences = ?, first_choice = ?, min_acceptable = ?, tier_mask = ?')
+            params.extend([preferences, first_choice, min_acceptable, tier_mask])
         if notes is not None:
             updates.append('notes = ?')
             params.append(notes)
 
         params.append(submission_id)
-        db.execute(f'UPDATE submissions SET {", ".join(updates)} WHERE id = ?', params)
+        row = db.execute(
+            f'UPDATE submissions SET {", ".join(updates)} WHERE id = ? RETURNING event_id', params
+        ).fetchone()
         db.commit()
+        if row:
+            Submission._publish_change('submission.updated', row['event_id'], submission_id)
 
     @staticmethod
     def update_allocation(submission_id, allocated):
         db = get_db()
-        db.execute(
-            'UPDATE submissions SET allocated = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        row = db.execute(
+            '''UPDATE submissions SET allocated = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+               RETURNING event_id''',
             (allocated, submission_id)
-        )
+        ).fetchone()
         db.commit()
+        if row:
+            _publish(row['event_id'], 'allocation.changed', {'allocations': {submission_id: allocated}})
+
+    @staticmethod
+    def bulk_update_allocations(event_id, allocations, finalize=False, notify=None):
+        """
+        Save many allocations for an event in a single transaction.
+
+        allocations maps submission id to allocated tickets. Only rows whose
+        value changed are written. With finalize=True the event is marked
+        finalized in the same transaction. notify, if given, is called with
+        the event's saved submissions and the connection, and queues outbox
+        messages in that transaction too, so a finalized event never loses
+        its notifications. Returns the number of rows updated.
+        """
+        db = get_db()
+        with db:
+            # Take the write lock up front so the comparison below stays valid
+            db.execute('BEGIN IMMEDIATE')
+            current = {
+                row['id']: row['allocated']
+                for row in db.execute(
+                    'SELECT id, allocated FROM submissions WHERE event_id = ?',
+                    (event_id,)
+                )
+            }
+            changed = [
+                (allocated, submission_id)
+                for submission_id, allocated in allocations.items()
+                if submission_id in current and current[submission_id] != allocated
+            ]
+            if changed:
+                db.executemany(
+                    'UPDATE submissions SET allocated = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                    changed
+                )
+            if finalize:
+                db.execute(
+                    "UPDATE events SET status = 'finalized', finalized_at = ? WHERE id = ?",
+                    (datetime.now(), event_id)
+                )
+            if notify is not None:
+                notify(Submission.get_all_for_event(event_id), db)
+        if changed or finalize:
+            _publish(event_id, 'allocation.changed', {
+                'allocations': {submission_id: allocated for allocated, submission_id in changed},
+                'finalized': finalize
+            })
+        return len(changed)
 
     @staticmethod
     def delete(submission_id):
         db = get_db()
-        db.execute('DELETE FROM submissions WHERE id = ?', (submission_id,))
+        row = db.execute(
+            'DELETE FROM submissions WHERE id = ? RETURNING event_id, user_id',
+            (submission_id,)
+        ).fetchone()
         db.commit()
+        if row:
+            _publish(row['event_id'], 'submission.withdrawn', {'id': submission_id, 'user_id': row['user_id']})
+
+    @staticmethod
+    def _publish_change(kind, event_id, submission_id):
+        """Publish a created/updated submission, with its user, to live streams."""
+        if not broker.has_subscribers(event_channel(event_id)):
+            return
+        sub = _select(
+            Submission,
+            f'''SELECT {Submission.SELECT_JOINED}, u.name, u.email
+                FROM submissions s
+                JOIN users u ON s.user_id = u.id
+                WHERE s.id = ?''',
+            (submission_id,)
+        ).fetchone()
+        if sub is None:
+            return
+        _publish(event_id, kind, {
+            'id': sub.id,
+            'user_id': sub.user_id,
+            'user_name': sub.user_name,
+            'preferences': sub.preferences,
+            'first_choice': sub.first_choice,
+            'min_acceptable': sub.min_acceptable,
+            'notes': sub.notes,
+            'allocated': sub.allocated
+        })
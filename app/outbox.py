@@ -0,0 +1,329 @@
+"""Durable email outbox drained by a background worker pool.
+
+Requests enqueue messages into the email_outbox table and return immediately.
+A worker claims due rows, sends them concurrently through a thread pool (rows
+queued from one template go out together as templated bulk sends) while
+respecting the SES send rate, and reschedules failures with exponential
+backoff. Claiming happens inside a write transaction, and the send rate is a
+token bucket in the database, so several gunicorn workers can each run a
+worker without sending a message twice or exceeding the SES quota together.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+
+from app.db import get_db
+from app.ratelimit import SQLiteBackend
+
+logger = logging.getLogger(__name__)
+
+# A claimed message is retried if its worker has not reported back by then
+CLAIM_LEASE = timedelta(minutes=5)
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+
+def enqueue(messages, db=None):
+    """
+    Queue emails for background delivery.
+
+    messages is an iterable of (to, subject, body_html, body_text) tuples,
+    optionally with a fifth element giving the earliest time to send.
+    Given a db connection, the rows are inserted without committing, so
+    they become part of the caller's open transaction.
+    Returns the number of messages queued.
+    """
+    now = datetime.now()
+    rows = [(*message[:4], message[4] if len(message) > 4 else now, None, None)
+            for message in messages]
+    return _insert(rows, db)
+
+
+def enqueue_template(template, recipients, default_data=None, db=None):
+    """
+    Queue one app.email.MessageTemplate for many recipients.
+
+    recipients is a list of (to, data) pairs; data is merged over
+    default_data. Each row keeps the template name and its data, so the
+    worker can send rows that come due together in one templated bulk call.
+    The rendered bodies are stored too, for backends without bulk sends.
+    db works as for enqueue(). Returns the number of messages queued.
+    """
+    now = datetime.now()
+    default_data = default_data or {}
+    rows = []
+    for to, data in recipients:
+        data = {**default_data, **data}
+        rows.append((to, *template.render(data), now, template.name, json.dumps(data, default=str)))
+    return _insert(rows, db)
+
+
+def _insert(rows, db):
+    if not rows:
+        return 0
+    commit = db is None
+    db = db or get_db()
+    db.executemany(
+        '''INSERT INTO email_outbox
+               (recipient, subject, body_html, body_text, next_attempt_at, template, template_data)
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        rows
+    )
+    if commit:
+        db.commit()
+    return len(rows)
+
+
+def claim_batch(limit):
+    """Atomically mark up to `limit` due messages as sending and return them."""
+    db = get_db()
+    now = datetime.now()
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        rows = db.execute(
+            '''SELECT * FROM email_outbox
+               WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+               ORDER BY next_attempt_at, id
+               LIMIT ?''',
+            (now, limit)
+        ).fetchall()
+        if rows:
+            db.executemany(
+                '''UPDATE email_outbox
+                   SET status = 'sending', attempts = attempts + 1, next_attempt_at = ?
+                   WHERE id = ?''',
+                [(now + CLAIM_LEASE, row['id']) for row in rows]
+            )
+    return rows
+
+
+def record_results(results, max_attempts):
+    """
+    Store delivery outcomes for claimed messages.
+
+    results is a list of (row, error) pairs where error is None on success.
+    Failed messages are rescheduled with exponential backoff until they
+    reach max_attempts, after which they are marked failed.
+    """
+    now = datetime.now()
+    sent = []
+    retry = []
+    failed = []
+    for row, error in results:
+        attempts = row['attempts'] + 1
+        if error is None:
+            sent.append((now, row['id']))
+        elif attempts >= max_attempts:
+            failed.append((error, row['id']))
+        else:
+            delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+            retry.append((error, now + timedelta(seconds=delay), row['id']))
+
+    db = get_db()
+    with db:
+        db.executemany(
+            "UPDATE email_outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+            sent
+        )
+        db.executemany(
+            "UPDATE email_outbox SET status = 'pending', last_error = ?, next_attempt_at = ? WHERE id = ?",
+            retry
+        )
+        db.executemany(
+            "UPDATE email_outbox SET status = 'failed', last_error = ? WHERE id = ?",
+            failed
+        )
+
+
+class RateLimiter:
+    """
+    Token bucket limiting sends to `rate` per second across every process.
+
+    The bucket lives in the rate_limits table (see app/ratelimit.py), so
+    outbox workers in several gunicorn workers share one SES send rate
+    instead of each sending at the full rate. Must be used inside an app
+    context.
+    """
+
+    KEY = 'outbox:send'
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._bucket = SQLiteBackend()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while not self._bucket.take(self.KEY, self.capacity, self.capacity / self.rate):
+            time.sleep(1 / self.rate)
+
+
+class StubBackend:
+    """Records messages instead of sending them, for tests and local runs."""
+
+    def __init__(self, fail_first=0):
+        self.sent = []
+        self.fail_first = fail_first
+        self._lock = threading.Lock()
+
+    def __call__(self, to, subject, body_html, body_text=None):
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return False
+            self.sent.append((to, subject, body_html, body_text))
+            return True
+
+
+class OutboxWorker:
+    """Drains the email outbox using a pool of sender threads."""
+
+    def __init__(self, app, send=None, max_workers=None, rate=None, batch_size=None):
+        config = app.config
+        self.app = app
+        self.send = send
+        self.max_workers = max_workers or config.get('EMAIL_OUTBOX_WORKERS', 4)
+        self.batch_size = batch_size or config.get('EMAIL_OUTBOX_BATCH_SIZE', 50)
+        self.max_attempts = config.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+        self.poll_interval = config.get('EMAIL_OUTBOX_POLL_INTERVAL', 2)
+        self.limiter = RateLimiter(rate or config.get('SES_MAX_SEND_RATE', 14))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _deliver(self, row):
+        """Send one message; returns None on success or an error string."""
+        with self.app.app_context():
+            if self.send is None:
+                from app.email import send_email
+                send = send_email
+            else:
+                send = self.send
+            try:
+                ok = send(row['recipient'], row['subject'], row['body_html'], row['body_text'])
+            except Exception as e:
+                return str(e)
+            return None if ok else 'Send failed'
+
+    def _deliver_bulk(self, template, rows):
+        """Send rows sharing a template in templated bulk calls; returns an error or None per row."""
+        with self.app.app_context():
+            from app.email import send_bulk
+            try:
+                results = send_bulk(
+                    template,
+                    [(row['recipient'], json.loads(row['template_data'])) for row in rows]
+                )
+            except Exception as e:
+                return [str(e)] * len(rows)
+            return [None if ok else 'Send failed' for ok in results]
+
+    def drain_once(self, pool):
+        """Claim and deliver one batch. Returns the number of messages handled."""
+        with self.app.app_context():
+            rows = claim_batch(self.batch_size)
+            if not rows:
+                return 0
+            from app.email import TEMPLATES
+
+            single = []
+            groups = {}
+            for row in rows:
+                template = TEMPLATES.get(row['template']) if self.send is None else None
+                if template is not None and row['template_data']:
+                    groups.setdefault(template, []).append(row)
+                else:
+                    self.limiter.acquire()
+                    single.append((row, pool.submit(self._deliver, row)))
+            bulk = []
+            for template, group in groups.items():
+                for _ in group:
+                    self.limiter.acquire()
+                bulk.append((group, pool.submit(self._deliver_bulk, template, group)))
+
+            results = [(row, future.result()) for row, future in single]
+            for group, future in bulk:
+                results.extend(zip(group, future.result()))
+            record_results(results, self.max_attempts)
+            return len(rows)
+
+    def drain(self):
+        """Deliver everything that is currently due, then return."""
+        total = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                handled = self.drain_once(pool)
+                if not handled:
+                    return total
+                total += handled
+
+    def run(self):
+        """Poll the outbox until stop() is called."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while not self._stop.is_set():
+                try:
+                    handled = self.drain_once(pool)
+                except Exception:
+                    logger.exception('Email outbox worker error')
+                    handled = 0
+                if not handled:
+                    self._stop.wait(self.poll_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='email-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def ensure_worker(app):
+    """Start the background worker once per process (fork-safe)."""
+    global _worker, _worker_pid
+    if _worker_pid == os.getpid():
+        return _worker
+    with _worker_lock:
+        if _worker_pid != os.getpid():
+            _worker = OutboxWorker(app)
+            _worker.start()
+            _worker_pid = os.getpid()
+    return _worker
+
+
+@click.command('outbox-drain')
+@click.option('--stub', is_flag=True, help='Record messages instead of sending them.')
+def outbox_drain_command(stub):
+    """Send all due queued emails, then exit."""
+    backend = StubBackend() if stub else None
+    sent = OutboxWorker(current_app._get_current_object(), send=backend).drain()
+    click.echo(f'Processed {sent} queued email(s).')
+
+
+@click.command('outbox-worker')
+def outbox_worker_command():
+    """Run the email outbox worker in the foreground."""
+    OutboxWorker(current_app._get_current_object()).run()
+
+
+def init_app(app):
+    app.cli.add_command(outbox_drain_command)
+    app.cli.add_command(outbox_worker_command)
+
+    if app.config.get('EMAIL_OUTBOX_AUTOSTART'):
+        @app.before_request
+        def start_outbox_worker():
+            ensure_worker(app)
@@ -0,0 +1,59 @@
+"""Keyset (cursor-based) pagination helpers.
+
+Pages are addressed by the sort key of their first or last row rather than
+an OFFSET, so fetching page 500 costs the same as fetching page 1. Cursors
+are opaque URL-safe strings encoding that sort key.
+"""
+
+import base64
+import json
+
+
+class Page:
+    """One page of results with cursors for the neighbouring pages."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """Encode a sort key (sequence of JSON-serializable values) as a cursor."""
+    raw = json.dumps(list(values), default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor into a (sort value, id) tuple, or return None if it is
+    missing or invalid. Only strings and numbers are accepted, since the
+    values are bound straight into SQL.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != 2:
+        return None
+    if not all(isinstance(value, (str, int, float)) and not isinstance(value, bool)
+               for value in values):
+        return None
+    return tuple(values)
@@ -0,0 +1,199 @@
+"""
+Opt-in sampling profiler for individual requests.
+
+With PROFILING_ENABLED on, an admin can profile one request by sending an
+"X-Profile: 1" header or adding ?_profile=1, and PROFILE_SAMPLE_RATE = N
+profiles one in every N requests from anyone. A profiled request gets a
+sampler thread that records the request thread's stack every
+PROFILE_INTERVAL seconds, so the view itself runs at full speed.
+
+Profiles are written to PROFILE_DIR as folded stacks ("frame;frame;frame
+count" per line), the input format of flamegraph.pl and speedscope, next
+to a small JSON file describing the request. Only the newest
+PROFILE_MAX_FILES are kept. Admins browse them at /admin/profiles.
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from flask import current_app, g, request
+from flask_login import current_user
+
+HEADER = 'X-Profile'
+QUERY_FLAG = '_profile'
+
+_active = 0
+_active_lock = threading.Lock()
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Sampler:
+    """Collects the stacks of one thread at a fixed interval until stopped."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='profile-sampler')
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[self._stack(frame)] += 1
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = _label(code)
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+
+def _label(code):
+    """function (file:line), with paths shortened to the project or site-packages."""
+    filename = code.co_filename
+    if filename.startswith(_ROOT):
+        filename = os.path.relpath(filename, _ROOT)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[1]
+    # ';' separates frames in the folded format
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def _requested():
+    """True if this request should be profiled."""
+    if request.headers.get(HEADER) == '1' or request.args.get(QUERY_FLAG) == '1':
+        return current_user.is_authenticated and current_user.is_admin
+    rate = current_app.config.get('PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.random() * rate < 1
+
+
+def _start_profile():
+    global _active
+    if not _requested():
+        return
+    with _active_lock:
+        # Bound the sampler threads a burst of profiled requests can start
+        if _active >= current_app.config.get('PROFILE_MAX_CONCURRENT', 2):
+            return
+        _active += 1
+    sampler = Sampler(threading.get_ident(), current_app.config.get('PROFILE_INTERVAL', 0.005))
+    g.profile = {
+        'id': f'{datetime.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:6]}',
+        'sampler': sampler,
+        'started': time.perf_counter()
+    }
+    sampler.start()
+
+
+def _add_profile_header(response):
+    profile = g.get('profile')
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile['id']
+        profile['status'] = response.status_code
+    return response
+
+
+def _finish_profile(exc=None):
+    global _active
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    try:
+        samples = profile['sampler'].stop()
+        duration = time.perf_counter() - profile['started']
+        save(profile['id'], samples, {
+            'id': profile['id'],
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': profile.get('status', 500 if exc else None),
+            'duration_ms': round(duration * 1000, 1),
+            'samples': sum(samples.values()),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'pid': os.getpid()
+        })
+    finally:
+        with _active_lock:
+            _active -= 1
+
+
+def _directory():
+    return current_app.config['PROFILE_DIR']
+
+
+def save(profile_id, samples, meta):
+    """Write one profile and drop the oldest beyond PROFILE_MAX_FILES."""
+    directory = _directory()
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, profile_id)
+    with open(base + '.folded', 'w') as f:
+        for stack, count in samples.most_common():
+            f.write(f'{stack} {count}\n')
+    with open(base + '.json', 'w') as f:
+        json.dump(meta, f)
+
+    # Ids start with a timestamp, so name order is age order
+    names = sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+    for old in names[:-current_app.config.get('PROFILE_MAX_FILES', 50)]:
+        for suffix in ('.json', '.folded'):
+            try:
+                os.unlink(os.path.join(directory, old + suffix))
+            except FileNotFoundError:
+                pass  # Another worker got there first
+
+
+def list_profiles():
+    """Metadata of every stored profile, newest first."""
+    directory = _directory()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id):
+    """Path of a profile's folded stacks, or None if there is no such profile."""
+    if not all(c.isalnum() or c == '-' for c in profile_id):
+        return None
+    path = os.path.join(_directory(), profile_id + '.folded')
+    return path if os.path.exists(path) else None
+
+
+def init_app(app):
+    if not app.config.get('PROFILING_ENABLED'):
+        return
+    app.before_request(_start_profile)
+    app.after_request(_add_profile_header)
+    app.teardown_request(_finish_profile)
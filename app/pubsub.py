@@ -0,0 +1,93 @@
+"""
+In-process publish/subscribe for live page updates.
+
+Model writes publish small deltas to a per-event channel; each open
+server-sent events stream (see events.event_stream) holds a subscription
+and forwards what it receives. Delivery is best effort and local to one
+worker process: a slow subscriber drops messages rather than blocking
+writers, and streams fall back to comparing the event version to catch
+writes made by other workers.
+"""
+
+import queue
+import threading
+
+
+class Subscription:
+    """A bounded queue of (kind, data) messages for one subscriber."""
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout=None):
+        """Return the next message, or None if none arrives within timeout."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Broker:
+    """Thread-safe fan-out of messages to the subscribers of a channel."""
+
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def has_subscribers(self, channel):
+        return channel in self._channels
+
+    def publish(self, channel, kind, data):
+        """Deliver (kind, data) to every current subscriber of channel."""
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put((kind, data))
+        return len(subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'subscribers': sum(len(subs) for subs in self._channels.values())
+            }
+
+
+broker = Broker()
+
+
+def event_channel(event_id):
+    return f'event:{event_id}'
@@ -0,0 +1,120 @@
+"""
+Token-bucket rate limits for the magic-link login form.
+
+Each bucket holds up to `limit` tokens and refills at limit/period tokens
+per second; a request takes one token or is rejected. Buckets are keyed
+by client IP and by email address, and live either in this process
+(MemoryBackend, per worker) or in the rate_limits table (SQLiteBackend,
+shared by every worker). LOGIN_RATE_LIMIT_BACKEND picks one.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app.db import get_db
+from app import metrics
+
+
+class MemoryBackend:
+    """Buckets in a dict, LRU-bounded so a flood of distinct keys can't grow it forever."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, period):
+        """Take one token from key's bucket; returns False if it is empty."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated) * limit / period)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBackend:
+    """
+    Buckets in the rate_limits table, so every worker shares them.
+
+    Refill, check and take happen in one upsert: the UPDATE only applies
+    when a token is available, and RETURNING yields no row when it isn't.
+    """
+
+    # Seconds between deletes of expired buckets. A bucket untouched for a
+    # whole period has refilled, so dropping it changes nothing.
+    PURGE_INTERVAL = 600
+
+    def __init__(self):
+        self._last_purge = 0.0
+
+    def take(self, key, limit, period):
+        now = time.time()
+        db = get_db()
+        row = db.execute(
+            '''INSERT INTO rate_limits (key, tokens, updated_at, expires_at)
+               VALUES (:key, :limit - 1, :now, :now + :period)
+               ON CONFLICT (key) DO UPDATE SET
+                   tokens = MIN(:limit, tokens + (:now - updated_at) * :limit / :period) - 1,
+                   updated_at = :now,
+                   expires_at = :now + :period
+               WHERE MIN(:limit, tokens + (:now - updated_at) * :limit / :period) >= 1
+               RETURNING tokens''',
+            # Floats, so SQLite never does integer division
+            {'key': key, 'limit': float(limit), 'period': float(period), 'now': now}
+        ).fetchone()
+        db.commit()
+        if now - self._last_purge >= self.PURGE_INTERVAL:
+            self._last_purge = now
+            db.execute('DELETE FROM rate_limits WHERE expires_at <= ?', (now,))
+            db.commit()
+        return row is not None
+
+    def reset(self):
+        db = get_db()
+        db.execute('DELETE FROM rate_limits')
+        db.commit()
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'sqlite': SQLiteBackend,
+}
+
+def allow_login(kind, value):
+    """
+    Take a token from the login bucket for an IP (kind 'ip') or email
+    (kind 'email'). Returns False, and counts the rejection, when the
+    bucket is empty. Always True when limiting is off.
+    """
+    backend = current_app.extensions.get('login_rate_limit')
+    if backend is None:
+        return True
+    config = current_app.config
+    limit = config[f'LOGIN_RATE_LIMIT_{kind.upper()}']
+    period = config[f'LOGIN_RATE_LIMIT_{kind.upper()}_PERIOD']
+    if limit <= 0:
+        return True
+    if backend.take(f'login:{kind}:{value}', limit, period):
+        return True
+    metrics.registry.inc('login_rate_limited_total', (kind,))
+    return False
+
+
+def init_app(app):
+    name = app.config.get('LOGIN_RATE_LIMIT_BACKEND', 'sqlite')
+    if name == 'off':
+        return
+    if name not in BACKENDS:
+        raise ValueError(f"LOGIN_RATE_LIMIT_BACKEND must be one of {', '.join(BACKENDS)} or off, not {name!r}")
+    app.extensions['login_rate_limit'] = BACKENDS[name]()
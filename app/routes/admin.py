@@ -1,12 +1,23 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify,
+                   Response, abort, send_file)
 from flask_login import login_required, current_user
 from functools import wraps
-from app.models import User, Event
-from app.forms import UserForm, AdminCreateUserForm
+from datetime import date
+import hmac
+import io
+from app.models import User, Event, user_cache
+from app.fragments import fragment_cache
+from app import metrics, profiling
+from app.export import FORMATS, export_response, iter_range_rows
+from app.forms import UserForm, AdminCreateUserForm, UserImportForm
 from app.email import send_welcome_email
+from app.user_import import import_users as run_user_import
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+# Rows shown per section on the admin panel
+ADMIN_SUMMARY_SIZE = 5
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -20,15 +31,21 @@ def admin_required(f):
 @login_required
 @admin_required
 def index():
-    users = User.get_all()
-    events = Event.get_all()
+    users = User.get_page(after=request.args.get('users_after'),
+                          before=request.args.get('users_before'),
+                          per_page=ADMIN_SUMMARY_SIZE)
+    events = Event.get_page(after=request.args.get('events_after'),
+                            before=request.args.get('events_before'),
+                            per_page=ADMIN_SUMMARY_SIZE)
     return render_template('admin/index.html', users=users, events=events)
 
 @bp.route('/users')
 @login_required
 @admin_required
 def users():
-    users = User.get_all()
+    users = User.get_page(after=request.args.get('after'),
+                          before=request.args.get('before'),
+                          per_page=current_app.config['PAGE_SIZE'])
     return render_template('admin/users.html', users=users)
 
 @bp.route('/users/add', methods=['GET', 'POST'])
@@ -55,6 +72,25 @@ def add_user():
         return redirect(url_for('admin.users'))
     return render_template('admin/add_user.html', form=form)
 
+@bp.route('/users/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_users():
+    form = UserImportForm()
+    result = None
+    if form.validate_on_submit():
+        lines = io.TextIOWrapper(form.csv_file.data.stream, encoding='utf-8-sig')
+        try:
+            result = run_user_import(lines, send_welcome=form.send_welcome.data)
+        except UnicodeDecodeError:
+            form.csv_file.errors.append('The file must be UTF-8 encoded CSV.')
+        else:
+            message = f'Imported {len(result.created)} user(s).'
+            if result.emails_queued:
+                message += f' {result.emails_queued} welcome email(s) are being sent.'
+            flash(message, 'success' if result.created else 'info')
+    return render_template('admin/import_users.html', form=form, result=result)
+
 @bp.route('/users/<int:user_id>/edit', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -139,3 +175,67 @@ def delete_event(event_id):
     Event.delete(event_id)
     flash('Event deleted successfully.', 'success')
     return redirect(url_for('admin.index'))
+
+@bp.route('/cache-stats')
+@login_required
+@admin_required
+def cache_stats():
+    """Hit/miss counters for this worker's in-process caches."""
+    return jsonify(users=user_cache.stats(), fragments=fragment_cache.stats())
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus metrics for every worker.
+
+    Admins can open it in the browser; scrapers send
+    "Authorization: Bearer <METRICS_TOKEN>" instead of a session.
+    """
+    if not current_app.config.get('METRICS_ENABLED'):
+        abort(404)
+    token = current_app.config.get('METRICS_TOKEN')
+    scraper = token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not scraper and not (current_user.is_authenticated and current_user.is_admin):
+        abort(403)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/profiles')
+@login_required
+@admin_required
+def profiles():
+    """Captured request profiles, sortable by route or duration."""
+    sort = request.args.get('sort')
+    items = profiling.list_profiles()
+    if sort == 'duration':
+        items.sort(key=lambda p: p.get('duration_ms') or 0, reverse=True)
+    elif sort == 'route':
+        items.sort(key=lambda p: (p.get('endpoint') or '', -(p.get('duration_ms') or 0)))
+    return render_template('admin/profiles.html', profiles=items, sort=sort)
+
+@bp.route('/profiles/<profile_id>.folded')
+@login_required
+@admin_required
+def download_profile(profile_id):
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='text/plain', as_attachment=True,
+                     download_name=f'{profile_id}.folded')
+
+@bp.route('/export')
+@login_required
+@admin_required
+def export_range():
+    """Download submissions for every event dated between ?start= and ?end= (inclusive)."""
+    fmt = request.args.get('format', 'csv')
+    try:
+        start = date.fromisoformat(request.args.get('start', ''))
+        end = date.fromisoformat(request.args.get('end', ''))
+    except ValueError:
+        flash('Enter a start and end date to export.', 'error')
+        return redirect(url_for('admin.index'))
+    if end < start or fmt not in FORMATS:
+        flash('Invalid export range or format.', 'error')
+        return redirect(url_for('admin.index'))
+
+    return export_response(iter_range_rows(start, end), fmt, f'submissions-{start}-to-{end}')
@@ -0,0 +1,310 @@
+"""
+Versioned JSON API for events, submissions and allocation drafts.
+
+Authentication uses the normal session cookie. Writes are CSRF-protected
+like the HTML forms: send the token from GET /api/v1/session in an
+X-CSRFToken header.
+
+Every GET accepts ?fields=a,b,c to return only the named fields, and list
+endpoints accept ?format=compact to return {"fields": [...], "rows": [[...]]}
+instead of repeating the keys in every object.
+"""
+
+from functools import wraps
+from flask import Blueprint, request, jsonify
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from werkzeug.datastructures import MultiDict
+from app.models import Event, Submission
+from app.forms import SubmissionForm
+from app.conditional import Validators
+from app.instrumentation import query_budget
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+EVENT_FIELDS = ('id', 'name', 'event_date', 'total_tickets', 'notes', 'status', 'created_by',
+                'creator_name', 'submission_count', 'total_requested', 'total_min',
+                'total_allocated', 'user_submitted', 'version')
+
+SUBMISSION_FIELDS = ('id', 'event_id', 'user_id', 'user_name', 'preferences', 'first_choice',
+                     'min_acceptable', 'notes', 'allocated', 'submitted_at', 'updated_at')
+
+
+def _error(message, status):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+def api_login_required(f):
+    """Like login_required, but answers 401 JSON instead of redirecting."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return _error('Authentication required.', 401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _text(value):
+    """Dates come back from SQLite as strings, but may be datetimes if just written."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return value.isoformat(sep=' ')
+
+
+def _event_json(event, stats):
+    """
+    total_allocated is null for people who can't allocate until the event
+    is finalized, since drafts are only visible to its managers.
+    """
+    stats = stats or {}
+    return {
+        'id': event.id,
+        'name': event.name,
+        'event_date': _text(event.event_date),
+        'total_tickets': event.total_tickets,
+        'notes': event.notes,
+        'status': event.status,
+        'created_by': event.created_by,
+        'creator_name': stats.get('creator_name'),
+        'submission_count': stats.get('submission_count', 0),
+        'total_requested': stats.get('total_requested', 0),
+        'total_min': stats.get('total_min', 0),
+        'total_allocated': (stats.get('total_allocated', 0)
+                            if event.is_finalized or _can_allocate(event) else None),
+        'user_submitted': stats.get('user_submitted', False),
+        'version': stats.get('version')
+    }
+
+
+def _submission_json(submission):
+    return {
+        'id': submission.id,
+        'event_id': submission.event_id,
+        'user_id': submission.user_id,
+        'user_name': getattr(submission, 'user_name', None),
+        'preferences': submission.preferences_list[:-1],
+        'first_choice': submission.first_choice,
+        'min_acceptable': submission.min_acceptable,
+        'notes': submission.notes,
+        'allocated': submission.allocated,
+        'submitted_at': _text(submission.submitted_at),
+        'updated_at': _text(submission.updated_at)
+    }
+
+
+class FieldError(ValueError):
+    pass
+
+
+def _requested_fields(available):
+    """The fields named in ?fields=, validated against `available`."""
+    fields = request.args.get('fields')
+    if not fields:
+        return available
+    selected = tuple(name.strip() for name in fields.split(',') if name.strip())
+    unknown = [name for name in selected if name not in available]
+    if unknown:
+        raise FieldError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(available)}")
+    return selected
+
+
+def _serialize_one(item, available):
+    fields = _requested_fields(available)
+    return {name: item[name] for name in fields}
+
+
+def _serialize_many(items, available, **extra):
+    fields = _requested_fields(available)
+    if request.args.get('format') == 'compact':
+        return dict(fields=fields, rows=[[item[name] for name in fields] for item in items], **extra)
+    return dict(data=[{name: item[name] for name in fields} for item in items], **extra)
+
+
+@bp.errorhandler(FieldError)
+def handle_field_error(e):
+    return _error(str(e), 400)
+
+
+def _viewer():
+    return (current_user.id, current_user.name, current_user.is_admin)
+
+
+def _event_validators(event_id, resource):
+    """Validators for a per-event resource, or None if the event is missing."""
+    version = Event.get_version(event_id)
+    if not version:
+        return None
+    parts = (resource, event_id, version[0], _viewer(), request.query_string)
+    return Validators(parts, version[1])
+
+
+def _can_allocate(event):
+    return event.created_by == current_user.id or current_user.is_admin
+
+
+@bp.route('/session')
+@api_login_required
+def session_info():
+    """The current user and a CSRF token for write requests."""
+    return jsonify(
+        user={'id': current_user.id, 'name': current_user.name, 'is_admin': current_user.is_admin},
+        csrf_token=generate_csrf()
+    )
+
+
+@bp.route('/events')
+@api_login_required
+@query_budget(4)
+def list_events():
+    """Open events with their aggregate stats."""
+    events = Event.get_all_open()
+    stats = Event.get_stats_for_events([event.id for event in events], user_id=current_user.id)
+    items = [_event_json(event, stats.get(event.id)) for event in events]
+    return jsonify(_serialize_many(items, EVENT_FIELDS))
+
+
+@bp.route('/events/<int:event_id>')
+@api_login_required
+def get_event(event_id):
+    validators = _event_validators(event_id, 'api-event')
+    if validators is None:
+        return _error('Event not found.', 404)
+    not_modified = validators.not_modified()
+    if not_modified:
+        return not_modified
+
+    event = Event.get_by_id(event_id)
+    if not event:
+        return _error('Event not found.', 404)
+    stats = Event.get_stats_for_events([event_id], user_id=current_user.id)
+    return validators.apply(jsonify(_serialize_one(_event_json(event, stats.get(event_id)), EVENT_FIELDS)))
+
+
+@bp.route('/events/<int:event_id>/submission', methods=['GET'])
+@api_login_required
+def get_my_submission(event_id):
+    submission = Submission.get_by_event_and_user(event_id, current_user.id)
+    if not submission:
+        return _error('No submission for this event.', 404)
+    return jsonify(_serialize_one(_submission_json(submission), SUBMISSION_FIELDS))
+
+
+@bp.route('/events/<int:event_id>/submission', methods=['PUT'])
+@api_login_required
+def put_my_submission(event_id):
+    """Create or replace the current user's submission."""
+    event = Event.get_by_id(event_id)
+    if not event:
+        return _error('Event not found.', 404)
+    if not event.is_open:
+        return _error('This event is no longer accepting submissions.', 409)
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return _error('Expected a JSON object.', 400)
+    preferences = payload.get('preferences')
+    if isinstance(preferences, list):
+        # Accept [3, 1] as well as "3,1,0"; the trailing 0 is implied
+        if not all(isinstance(p, int) and not isinstance(p, bool) for p in preferences):
+            return _error('preferences must be a list of integers.', 400)
+        tiers = [str(p) for p in preferences]
+        preferences = ','.join(tiers + ['0'] if tiers and tiers[-1] != '0' else tiers)
+    elif preferences is not None and not isinstance(preferences, str):
+        return _error('preferences must be a list of integers or a string.', 400)
+    notes = payload.get('notes')
+    if notes is None:
+        notes = ''
+    elif not isinstance(notes, str):
+        return _error('notes must be a string.', 400)
+
+    # CSRFProtect has already checked the request's X-CSRFToken header
+    form = SubmissionForm(formdata=MultiDict({'preferences': preferences or '', 'notes': notes}),
+                          meta={'csrf': False})
+    if not form.validate():
+        return jsonify(error='Invalid submission.', fields=form.errors), 400
+
+    existing = Submission.get_by_event_and_user(event_id, current_user.id)
+    if existing:
+        Submission.update(existing.id, preferences=form.preferences.data, notes=form.notes.data)
+        status = 200
+    else:
+        Submission.create(event_id=event_id, user_id=current_user.id,
+                          preferences=form.preferences.data, notes=form.notes.data)
+        status = 201
+    submission = Submission.get_by_event_and_user(event_id, current_user.id)
+    return jsonify(_submission_json(submission)), status
+
+
+@bp.route('/events/<int:event_id>/submission', methods=['DELETE'])
+@api_login_required
+def delete_my_submission(event_id):
+    event = Event.get_by_id(event_id)
+    if not event:
+        return _error('Event not found.', 404)
+    if not event.is_open:
+        return _error('Cannot withdraw from this event.', 409)
+    submission = Submission.get_by_event_and_user(event_id, current_user.id)
+    if not submission:
+        return _error('No submission for this event.', 404)
+    Submission.delete(submission.id)
+    return '', 204
+
+
+@bp.route('/events/<int:event_id>/allocations', methods=['GET'])
+@api_login_required
+def get_allocations(event_id):
+    """Every submission with its draft allocation, plus the event totals."""
+    event = Event.get_by_id(event_id)
+    if not event:
+        return _error('Event not found.', 404)
+    if not _can_allocate(event):
+        return _error('Only the event creator can allocate tickets.', 403)
+
+    validators = _event_validators(event_id, 'api-allocations')
+    not_modified = validators.not_modified() if validators else None
+    if not_modified:
+        return not_modified
+
+    submissions = Submission.get_all_for_event(event_id)
+    items = [_submission_json(sub) for sub in submissions]
+    body = _serialize_many(items, SUBMISSION_FIELDS, stats=Event.get_stats(event_id))
+    response = jsonify(body)
+    return validators.apply(response) if validators else response
+
+
+@bp.route('/events/<int:event_id>/allocations', methods=['PUT'])
+@api_login_required
+def put_allocations(event_id):
+    """
+    Save a draft allocation.
+
+    Body: {"allocations": {"<submission id>": tickets, ...}}. Only the listed
+    submissions are changed; unknown ids are ignored.
+    """
+    event = Event.get_by_id(event_id)
+    if not event:
+        return _error('Event not found.', 404)
+    if not _can_allocate(event):
+        return _error('Only the event creator can allocate tickets.', 403)
+    if event.is_finalized:
+        return _error('This event has already been finalized.', 409)
+
+    payload = request.get_json(silent=True)
+    allocations = payload.get('allocations') if isinstance(payload, dict) else None
+    if not isinstance(allocations, dict):
+        return _error('Expected {"allocations": {submission_id: tickets}}.', 400)
+    # JSON object keys are always strings; the counts must be real integers,
+    # not floats or booleans that int() would quietly convert
+    if not all(type(tickets) is int for tickets in allocations.values()):
+        return _error('Submission ids and ticket counts must be integers.', 400)
+    try:
+        allocations = {int(sid): tickets for sid, tickets in allocations.items()}
+    except ValueError:
+        return _error('Submission ids and ticket counts must be integers.', 400)
+    if any(tickets < 0 for tickets in allocations.values()):
+        return _error('Ticket counts cannot be negative.', 400)
+
+    changed = Submission.bulk_update_allocations(event_id, allocations)
+    return jsonify(changed=changed, stats=Event.get_stats(event_id))
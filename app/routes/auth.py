@@ -3,6 +3,7 @@ from flask_login import login_user, logout_user, login_required, current_user
 from app.models import User
 from app.forms import LoginForm
 from app.email import send_magic_link_email
+from app.ratelimit import allow_login
 
 bp = Blueprint('auth', __name__)
 
@@ -18,8 +19,16 @@ def login():
         return redirect(url_for('events.dashboard'))
 
     form = LoginForm()
+    # Rate limits come before any lookup, token write or email
+    if request.method == 'POST' and not allow_login('ip', request.remote_addr):
+        flash('Too many login requests. Please wait a few minutes and try again.', 'error')
+        return render_template('auth/login.html', form=form), 429
+
     if form.validate_on_submit():
-        user = User.get_by_email(form.email.data.lower())
+        email = form.email.data.lower()
+        # An address over its limit gets the usual reply, so the limit
+        # doesn't reveal whether the account exists
+        user = User.get_by_email(email) if allow_login('email', email) else None
         if user and user.is_active:
             token = User.generate_login_token(user.id)
             login_url = url_for('auth.verify_login', token=token, _external=True)
@@ -36,7 +45,8 @@ def verify_login(token):
     if current_user.is_authenticated:
         return redirect(url_for('events.dashboard'))
 
-    user = User.get_by_login_token(token)
+    # Single-use: the token is spent by this lookup
+    user = User.consume_login_token(token)
     if not user:
         flash('Invalid or expired login link. Please request a new one.', 'error')
         return redirect(url_for('auth.login'))
@@ -45,9 +55,6 @@ def verify_login(token):
         flash('Your account has been deactivated. Please contact an administrator.', 'error')
         return redirect(url_for('auth.login'))
 
-    # Clear the token (single-use)
-    User.clear_login_token(user.id)
-
     # Log the user in with remember=True for 1 year session
     login_user(user, remember=True)
     flash(f'Welcome, {user.name}!', 'success')
@@ -1,99 +1,92 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app,
+                   Response, stream_with_context)
 from flask_login import login_required, current_user
-from datetime import datetime
+from datetime import datetime, date
+import json
+import threading
+import time
 from app.models import Event, Submission, User
+from app.conditional import Validators
+from app.instrumentation import query_budget
 from app.forms import EventForm, SubmissionForm, CreatorSubmissionForm
-from app.email import send_allocation_email
+from app.email import queue_allocation_emails
+from app.allocation import allocate as auto_allocate
+from app.pubsub import broker, event_channel
+from app.export import FORMATS, export_response, iter_event_rows
 
 bp = Blueprint('events', __name__)
 
-def parse_preferences(pref_string):
-    """Parse comma-separated preferences string into list of ints."""
-    if not pref_string:
-        return []
-    return [int(x) for x in pref_string.split(',')]
+# Live-update streams open in this worker; each one holds a thread (see event_stream)
+_streams = 0
+_streams_lock = threading.Lock()
 
-def get_first_choice(pref_string):
-    """Get first (ideal) choice from preferences string."""
-    prefs = parse_preferences(pref_string)
-    return prefs[0] if prefs else 0
 
-def get_min_acceptable(pref_string):
-    """Get minimum acceptable (smallest non-zero) from preferences string."""
-    prefs = parse_preferences(pref_string)
-    non_zero = [p for p in prefs if p > 0]
-    return min(non_zero) if non_zero else 0
+def _viewer():
+    """The parts of the current user that change how pages render."""
+    return (current_user.id, current_user.name, current_user.is_admin)
+
+
+def _listing_validators(page, *extra):
+    """Validators for pages that list many events."""
+    generation, modified_at = Event.get_listing_version()
+    # The set of past events shown depends on today's date
+    return Validators((page, generation, date.today().isoformat(), _viewer(), *extra), modified_at)
+
 
 @bp.route('/dashboard')
 @login_required
+@query_budget(10)
 def dashboard():
+    validators = _listing_validators('dashboard')
+    not_modified = validators.not_modified()
+    if not_modified:
+        return not_modified
+
     open_events = Event.get_all_open()
     past_events = Event.get_all_past(limit=4)  # Only show last 4 on dashboard
-    total_past_count = len(Event.get_past_events_within_months(24))
-
-    # Build a dict of creator info and stats for all events
-    creators = {}
-    event_stats = {}
-    user_submissions = {}
-
-    for event in open_events + past_events:
-        # Creator info
-        if event.created_by not in creators:
-            creator = User.get_by_id(event.created_by)
-            creators[event.created_by] = creator.name if creator else 'Unknown'
-
-        # Event stats
-        submissions = Submission.get_all_for_event(event.id)
-        total_requested = sum(get_first_choice(s['preferences']) for s in submissions)
-        event_stats[event.id] = {
-            'submission_count': len(submissions),
-            'total_requested': total_requested
-        }
-
-        # Check if current user has submitted
-        user_sub = Submission.get_by_event_and_user(event.id, current_user.id)
-        user_submissions[event.id] = user_sub is not None
-
-    return render_template('events/dashboard.html',
+    total_past_count = Event.count_past_events_within_months(24)
+
+    # Creator names, stats and the current user's submission state in one query
+    event_stats = Event.get_stats_for_events(
+        [event.id for event in open_events + past_events],
+        user_id=current_user.id
+    )
+
+    return validators.apply(render_template('events/dashboard.html',
                            open_events=open_events,
                            past_events=past_events,
                            total_past_count=total_past_count,
-                           creators=creators,
-                           event_stats=event_stats,
-                           user_submissions=user_submissions)
+                           event_stats=event_stats))
 
 
 @bp.route('/events/history')
 @login_required
+@query_budget(8)
 def event_history():
     """Show all active events and past events from the last 24 months in a table view."""
-    active_events = Event.get_all_open()
-    past_events = Event.get_past_events_within_months(24)
+    after = request.args.get('after')
+    before = request.args.get('before')
+    validators = _listing_validators('history', after, before)
+    not_modified = validators.not_modified()
+    if not_modified:
+        return not_modified
+
+    past_page = Event.get_past_events_page(
+        24, after=after, before=before, per_page=current_app.config['PAGE_SIZE']
+    )
+    # Active events are listed above the first page of past events only,
+    # however it was reached (Previous from page 2 arrives with ?before=)
+    active_events = Event.get_all_open() if not past_page.has_prev else []
+    past_events = past_page.items
     all_events = active_events + past_events
 
-    # Build creator info for all events
-    creators = {}
-    event_stats = {}
-
-    for event in all_events:
-        if event.created_by not in creators:
-            creator = User.get_by_id(event.created_by)
-            creators[event.created_by] = creator.name if creator else 'Unknown'
-
-        submissions = Submission.get_all_for_event(event.id)
-        total_requested = sum(get_first_choice(s['preferences']) for s in submissions)
-        total_allocated = sum(s['allocated'] or 0 for s in submissions)
-        event_stats[event.id] = {
-            'submission_count': len(submissions),
-            'total_requested': total_requested,
-            'total_allocated': total_allocated
-        }
-
-    return render_template('events/history.html',
+    event_stats = Event.get_stats_for_events([event.id for event in all_events])
+
+    return validators.apply(render_template('events/history.html',
                            active_events=active_events,
                            past_events=past_events,
-                           creators=creators,
-                           event_stats=event_stats)
+                           past_page=past_page,
+                           event_stats=event_stats))
 
 @bp.route('/events/create', methods=['GET', 'POST'])
 @login_required
@@ -113,7 +106,16 @@ def create_event():
 
 @bp.route('/events/<int:event_id>')
 @login_required
+@query_budget(8)
 def event_detail(event_id):
+    version = Event.get_version(event_id)
+    validators = None
+    if version:
+        validators = Validators(('detail', event_id, version[0], _viewer()), version[1])
+        not_modified = validators.not_modified()
+        if not_modified:
+            return not_modified
+
     event = Event.get_by_id(event_id)
     if not event:
         flash('Event not found.', 'error')
@@ -123,22 +125,140 @@ def event_detail(event_id):
     user_submission = Submission.get_by_event_and_user(event_id, current_user.id)
     creator = event.get_creator()
 
-    # Calculate stats using new preferences format
-    total_first_choice = sum(get_first_choice(s['preferences']) for s in submissions)
-    total_min = sum(get_min_acceptable(s['preferences']) for s in submissions)
-    total_allocated = sum(s['allocated'] or 0 for s in submissions)
+    stats = Event.get_stats(event_id)
 
-    return render_template('events/detail.html',
+    response = render_template('events/detail.html',
                            event=event,
                            submissions=submissions,
                            user_submission=user_submission,
                            creator=creator,
-                           total_first_choice=total_first_choice,
-                           total_min=total_min,
-                           total_allocated=total_allocated,
-                           parse_preferences=parse_preferences,
-                           get_first_choice=get_first_choice,
-                           get_min_acceptable=get_min_acceptable)
+                           total_first_choice=stats['total_first_choice'],
+                           total_min=stats['total_min'],
+                           total_allocated=stats['total_allocated'],
+                           version=version[0] if version else None)
+    return validators.apply(response) if validators else response
+
+def _sse(kind, data, version=None):
+    """Format one server-sent event."""
+    lines = []
+    if version is not None:
+        lines.append(f'id: {version}')
+    lines.append(f'event: {kind}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"), default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def _version_bumps(kind, data):
+    """
+    How far the event version moves for the write behind a message.
+
+    The schema triggers bump the version once per changed submission row,
+    plus once for the event row when an allocation is finalized.
+    """
+    if kind == 'allocation.changed':
+        return max(1, len(data.get('allocations', ())) + (1 if data.get('finalized') else 0))
+    return 1
+
+
+def _redact(kind, data):
+    """Strip draft allocations from messages sent to people who can't see them."""
+    if kind == 'allocation.changed':
+        return {'finalized': True} if data.get('finalized') else None
+    data = dict(data)
+    data.pop('allocated', None)
+    if 'stats' in data:
+        data['stats'] = {k: v for k, v in data['stats'].items() if k != 'total_allocated'}
+    return data
+
+
+@bp.route('/events/<int:event_id>/stream')
+@login_required
+def event_stream(event_id):
+    """
+    Server-sent events for one event's submissions and allocations.
+
+    Sends submission.created, submission.updated, submission.withdrawn and
+    allocation.changed deltas published by this worker, plus a resync event
+    when the event's version moves for any other reason (for example a
+    write handled by another worker), telling the page to refetch.
+
+    Each stream holds a worker thread, so at most SSE_MAX_STREAMS are open
+    per worker; beyond that the request gets a 503 with a retry hint.
+    """
+    event = Event.get_by_id(event_id)
+    if not event:
+        return jsonify(error='Event not found.'), 404
+    private = not event.is_finalized and event.created_by != current_user.id and not current_user.is_admin
+
+    # The version the page was rendered at; EventSource reconnects send Last-Event-ID
+    known = request.headers.get('Last-Event-ID') or request.args.get('version')
+    try:
+        known = int(known)
+    except (TypeError, ValueError):
+        known = None
+
+    config = current_app.config
+    interval = config.get('SSE_CHECK_INTERVAL', 15)
+    max_duration = config.get('SSE_MAX_DURATION', 300)
+    retry_after = config.get('SSE_BUSY_RETRY', 30)
+
+    global _streams
+    with _streams_lock:
+        # Leave the rest of the worker's threads for ordinary requests
+        busy = _streams >= config.get('SSE_MAX_STREAMS', 4)
+        if not busy:
+            _streams += 1
+    if busy:
+        return Response(f'retry: {retry_after * 1000}\n\n', status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(retry_after), 'Cache-Control': 'no-cache'})
+
+    def release():
+        global _streams
+        with _streams_lock:
+            _streams -= 1
+
+    def generate():
+        checked = known
+        deadline = time.monotonic() + max_duration
+        next_check = time.monotonic()
+        with broker.subscribe(event_channel(event_id)) as subscription:
+            yield 'retry: 3000\n\n'
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    return  # The browser reconnects; this frees the worker thread
+                if now >= next_check:
+                    next_check = now + interval
+                    current = Event.get_version(event_id)
+                    if current is None:
+                        yield _sse('resync', {'deleted': True})
+                        return
+                    if current[0] != checked:
+                        if checked is not None:
+                            yield _sse('resync', {}, current[0])
+                        checked = current[0]
+                    else:
+                        yield ': keepalive\n\n'
+                message = subscription.get(timeout=max(0.0, min(next_check, deadline) - time.monotonic()))
+                if message is None:
+                    continue
+                kind, data = message
+                version = data.get('version')
+                # A message that accounts for every bump since the last check
+                # means nothing was missed, so no resync is needed
+                if checked is not None and version == checked + _version_bumps(kind, data):
+                    checked = version
+                if private:
+                    data = _redact(kind, data)
+                    if data is None:
+                        continue
+                yield _sse(kind, data, version)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, even if the stream never started
+    response.call_on_close(release)
+    return response
 
 @bp.route('/events/<int:event_id>/submit', methods=['GET', 'POST'])
 @login_required
@@ -196,6 +316,7 @@ def withdraw_interest(event_id):
 
 @bp.route('/events/<int:event_id>/allocate', methods=['GET', 'POST'])
 @login_required
+@query_budget(10)
 def allocate(event_id):
     event = Event.get_by_id(event_id)
     if not event:
@@ -211,33 +332,44 @@ def allocate(event_id):
         return redirect(url_for('events.event_detail', event_id=event_id))
 
     submissions = Submission.get_all_for_event(event_id)
+    suggested = None
 
-    if request.method == 'POST':
+    if request.method == 'POST' and request.form.get('action') == 'auto':
+        # Pre-fill the form with a computed allocation; nothing is saved yet
+        suggested = auto_allocate(
+            [(s.id, s.tier_mask) for s in submissions],
+            event.total_tickets
+        )
+        flash('Suggested allocation filled in. Review it, then save the draft or finalize.', 'info')
+    elif request.method == 'POST':
         action = request.form.get('action')
 
-        # Save allocations
+        # Save allocations, the finalized status and any emails in one transaction
+        allocations = {}
         for sub in submissions:
-            allocated = request.form.get(f'allocated_{sub["id"]}', '0')
+            allocated = request.form.get(f'allocated_{sub.id}', '0')
             try:
                 allocated = int(allocated) if allocated else 0
             except ValueError:
                 allocated = 0
-            Submission.update_allocation(sub['id'], allocated)
-
-        if action == 'finalize':
-            Event.update(event_id, status='finalized', finalized_at=datetime.now())
+            allocations[sub.id] = allocated
+        finalize = action == 'finalize'
+        send_emails = finalize and request.form.get('send_emails') == '1'
+
+        def notify(saved, db):
+            # Allocation emails are queued with the finalize; the outbox worker delivers them
+            queue_allocation_emails(
+                event,
+                [(sub.user_name, sub.user_email, sub.first_choice, sub.allocated or 0) for sub in saved],
+                db=db
+            )
 
-            send_emails = request.form.get('send_emails') == '1'
+        Submission.bulk_update_allocations(event_id, allocations, finalize=finalize,
+                                           notify=notify if send_emails else None)
 
+        if finalize:
             if send_emails:
-                # Send allocation emails to all participants
-                updated_submissions = Submission.get_all_for_event(event_id)
-                for sub in updated_submissions:
-                    user = User.get_by_id(sub['user_id'])
-                    if user:
-                        requested = get_first_choice(sub['preferences'])
-                        send_allocation_email(user, event, requested, sub['allocated'] or 0)
-                flash('Allocations have been finalized and emails sent to participants.', 'success')
+                flash('Allocations have been finalized and emails are being sent to participants.', 'success')
             else:
                 flash('Allocations have been finalized. Emails were not sent.', 'success')
             return redirect(url_for('events.event_detail', event_id=event_id))
@@ -246,20 +378,37 @@ def allocate(event_id):
             return redirect(url_for('events.allocate', event_id=event_id))
 
     # Refresh submissions after potential save
+    version = Event.get_version(event_id)
     submissions = Submission.get_all_for_event(event_id)
-    total_first_choice = sum(get_first_choice(s['preferences']) for s in submissions)
-    total_min = sum(get_min_acceptable(s['preferences']) for s in submissions)
-    total_allocated = sum(s['allocated'] or 0 for s in submissions)
+    stats = Event.get_stats(event_id)
 
     return render_template('events/allocate.html',
                            event=event,
                            submissions=submissions,
-                           total_first_choice=total_first_choice,
-                           total_min=total_min,
-                           total_allocated=total_allocated,
-                           parse_preferences=parse_preferences,
-                           get_first_choice=get_first_choice,
-                           get_min_acceptable=get_min_acceptable)
+                           total_first_choice=stats['total_first_choice'],
+                           total_min=stats['total_min'],
+                           total_allocated=stats['total_allocated'],
+                           suggested=suggested,
+                           version=version[0] if version else None)
+
+@bp.route('/events/<int:event_id>/export.<fmt>')
+@login_required
+def export_event(event_id, fmt):
+    """Download every submission and allocation for an event as CSV or JSON Lines."""
+    if fmt not in FORMATS:
+        flash('Unknown export format.', 'error')
+        return redirect(url_for('events.event_detail', event_id=event_id))
+
+    event = Event.get_by_id(event_id)
+    if not event:
+        flash('Event not found.', 'error')
+        return redirect(url_for('events.dashboard'))
+
+    if event.created_by != current_user.id and not current_user.is_admin:
+        flash('Only the event creator can export submissions.', 'error')
+        return redirect(url_for('events.event_detail', event_id=event_id))
+
+    return export_response(iter_event_rows(event_id), fmt, f'event-{event_id}-submissions')
 
 @bp.route('/events/<int:event_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -399,7 +548,7 @@ def submit_for_user(event_id):
 
     # Get users who already have submissions
     existing_submissions = Submission.get_all_for_event(event_id)
-    users_with_submissions = {s['user_id'] for s in existing_submissions}
+    users_with_submissions = {s.user_id for s in existing_submissions}
 
     # Filter to users without submissions
     available_users = [u for u in all_users if u.id not in users_with_submissions]
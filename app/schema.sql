@@ -26,12 +26,29 @@ CREATE TABLE IF NOT EXISTS events (
     FOREIGN KEY (created_by) REFERENCES users(id)
 );
 
+-- Per-event aggregates, kept in sync with submissions by the triggers below
+CREATE TABLE IF NOT EXISTS event_stats (
+    event_id INTEGER PRIMARY KEY,
+    submission_count INTEGER NOT NULL DEFAULT 0,
+    total_first_choice INTEGER NOT NULL DEFAULT 0,
+    total_min INTEGER NOT NULL DEFAULT 0,
+    total_allocated INTEGER NOT NULL DEFAULT 0,
+    -- Bumped on every change to the event or its submissions (HTTP validators, caches)
+    version INTEGER NOT NULL DEFAULT 0,
+    modified_at DATETIME,
+    FOREIGN KEY (event_id) REFERENCES events(id)
+);
+
 -- Submissions table
 CREATE TABLE IF NOT EXISTS submissions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     event_id INTEGER NOT NULL,
     user_id INTEGER NOT NULL,
     preferences TEXT NOT NULL,
+    -- Derived from preferences at write time (see encode_preferences in models.py)
+    first_choice INTEGER NOT NULL DEFAULT 0,
+    min_acceptable INTEGER NOT NULL DEFAULT 0,
+    tier_mask INTEGER NOT NULL DEFAULT 0,
     notes TEXT,
     allocated INTEGER,
     submitted_at DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -41,8 +58,181 @@ CREATE TABLE IF NOT EXISTS submissions (
     UNIQUE(event_id, user_id)
 );
 
+-- Outgoing email queue, drained by the background worker in app/outbox.py
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body_html TEXT NOT NULL,
+    body_text TEXT,
+    template TEXT,       -- app.email.TEMPLATES name, for templated bulk sends
+    template_data TEXT,  -- JSON data the template was rendered with
+    status TEXT DEFAULT 'pending' CHECK(status IN ('pending', 'sending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NOT NULL,
+    last_error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    sent_at DATETIME
+);
+
+-- Magic-link login tokens; a user may hold several live ones. Only a
+-- SHA-256 of each token is stored (see User.generate_login_token).
+CREATE TABLE IF NOT EXISTS login_tokens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token_hash TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    expires_at DATETIME NOT NULL,
+    used_at DATETIME,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- Token buckets for login rate limits shared by all workers (see app/ratelimit.py)
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,  -- Unix time
+    expires_at REAL NOT NULL   -- Full again by then; safe to delete
+) WITHOUT ROWID;
+
+-- Version counters used to invalidate in-process caches across workers
+CREATE TABLE IF NOT EXISTS cache_versions (
+    namespace TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO cache_versions (namespace, version) VALUES ('users', 0);
+INSERT OR IGNORE INTO cache_versions (namespace, version) VALUES ('events', 0);
+
 -- Create indexes for common queries
 CREATE INDEX IF NOT EXISTS idx_events_status ON events(status);
 CREATE INDEX IF NOT EXISTS idx_events_date ON events(event_date);
+CREATE INDEX IF NOT EXISTS idx_events_date_id ON events(event_date, id);
+CREATE INDEX IF NOT EXISTS idx_users_name_id ON users(name, id);
 CREATE INDEX IF NOT EXISTS idx_submissions_event ON submissions(event_id);
 CREATE INDEX IF NOT EXISTS idx_submissions_user ON submissions(user_id);
+CREATE INDEX IF NOT EXISTS idx_submissions_event_totals ON submissions(event_id, first_choice, min_acceptable, allocated);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_event_stats_modified ON event_stats(modified_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_login_tokens_hash ON login_tokens(token_hash);
+CREATE INDEX IF NOT EXISTS idx_login_tokens_expires ON login_tokens(expires_at);
+
+-- Move tokens from the old single-token users.reset_token column
+INSERT OR IGNORE INTO login_tokens (token_hash, user_id, expires_at)
+SELECT reset_token, id, reset_token_expires FROM users
+WHERE reset_token IS NOT NULL AND reset_token_expires IS NOT NULL;
+UPDATE users SET reset_token = NULL, reset_token_expires = NULL WHERE reset_token IS NOT NULL;
+
+-- Keep event_stats exact on every write.
+-- Triggers are dropped and recreated so init_db upgrades existing databases.
+DROP TRIGGER IF EXISTS trg_events_insert_stats;
+CREATE TRIGGER trg_events_insert_stats
+AFTER INSERT ON events
+BEGIN
+    INSERT OR IGNORE INTO event_stats (event_id) VALUES (NEW.id);
+    UPDATE event_stats SET version = version + 1, modified_at = CURRENT_TIMESTAMP
+    WHERE event_id = NEW.id;
+    UPDATE cache_versions SET version = version + 1 WHERE namespace = 'events';
+END;
+
+DROP TRIGGER IF EXISTS trg_events_update_version;
+CREATE TRIGGER trg_events_update_version
+AFTER UPDATE ON events
+BEGIN
+    UPDATE event_stats SET version = version + 1, modified_at = CURRENT_TIMESTAMP
+    WHERE event_id = NEW.id;
+    UPDATE cache_versions SET version = version + 1 WHERE namespace = 'events';
+END;
+
+DROP TRIGGER IF EXISTS trg_events_delete_stats;
+CREATE TRIGGER trg_events_delete_stats
+AFTER DELETE ON events
+BEGIN
+    DELETE FROM event_stats WHERE event_id = OLD.id;
+    UPDATE cache_versions SET version = version + 1 WHERE namespace = 'events';
+END;
+
+DROP TRIGGER IF EXISTS trg_submissions_insert_stats;
+CREATE TRIGGER trg_submissions_insert_stats
+AFTER INSERT ON submissions
+BEGIN
+    INSERT OR IGNORE INTO event_stats (event_id) VALUES (NEW.event_id);
+    UPDATE event_stats SET
+        submission_count = submission_count + 1,
+        total_first_choice = total_first_choice + NEW.first_choice,
+        total_min = total_min + NEW.min_acceptable,
+        total_allocated = total_allocated + COALESCE(NEW.allocated, 0),
+        version = version + 1,
+        modified_at = CURRENT_TIMESTAMP
+    WHERE event_id = NEW.event_id;
+    UPDATE cache_versions SET version = version + 1 WHERE namespace = 'events';
+END;
+
+DROP TRIGGER IF EXISTS trg_submissions_update_stats;
+CREATE TRIGGER trg_submissions_update_stats
+AFTER UPDATE OF event_id, first_choice, min_acceptable, allocated ON submissions
+BEGIN
+    UPDATE event_stats SET
+        submission_count = submission_count - 1,
+        total_first_choice = total_first_choice - OLD.first_choice,
+        total_min = total_min - OLD.min_acceptable,
+        total_allocated = total_allocated - COALESCE(OLD.allocated, 0)
+    WHERE event_id = OLD.event_id;
+    INSERT OR IGNORE INTO event_stats (event_id) VALUES (NEW.event_id);
+    UPDATE event_stats SET
+        submission_count = submission_count + 1,
+        total_first_choice = total_first_choice + NEW.first_choice,
+        total_min = total_min + NEW.min_acceptable,
+        total_allocated = total_allocated + COALESCE(NEW.allocated, 0)
+    WHERE event_id = NEW.event_id;
+END;
+
+-- Notes and preferences changes don't move the totals but do change the pages
+DROP TRIGGER IF EXISTS trg_submissions_update_version;
+CREATE TRIGGER trg_submissions_update_version
+AFTER UPDATE ON submissions
+BEGIN
+    UPDATE event_stats SET version = version + 1, modified_at = CURRENT_TIMESTAMP
+    WHERE event_id IN (OLD.event_id, NEW.event_id);
+    UPDATE cache_versions SET version = version + 1 WHERE namespace = 'events';
+END;
+
+DROP TRIGGER IF EXISTS trg_submissions_delete_stats;
+CREATE TRIGGER trg_submissions_delete_stats
+AFTER DELETE ON submissions
+BEGIN
+    UPDATE event_stats SET
+        submission_count = submission_count - 1,
+        total_first_choice = total_first_choice - OLD.first_choice,
+        total_min = total_min - OLD.min_acceptable,
+        total_allocated = total_allocated - COALESCE(OLD.allocated, 0),
+        version = version + 1,
+        modified_at = CURRENT_TIMESTAMP
+    WHERE event_id = OLD.event_id;
+    UPDATE cache_versions SET version = version + 1 WHERE namespace = 'events';
+END;
+
+-- Any change to a user invalidates cached users in every worker
+DROP TRIGGER IF EXISTS trg_users_update_version;
+CREATE TRIGGER trg_users_update_version
+AFTER UPDATE ON users
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE namespace = 'users';
+END;
+
+-- Names and emails appear on event pages, so renaming a user changes their events
+DROP TRIGGER IF EXISTS trg_users_update_events;
+CREATE TRIGGER trg_users_update_events
+AFTER UPDATE OF name, email ON users
+BEGIN
+    UPDATE event_stats SET version = version + 1, modified_at = CURRENT_TIMESTAMP
+    WHERE event_id IN (SELECT event_id FROM submissions WHERE user_id = NEW.id
+                       UNION SELECT id FROM events WHERE created_by = NEW.id);
+    UPDATE cache_versions SET version = version + 1 WHERE namespace = 'events';
+END;
+
+DROP TRIGGER IF EXISTS trg_users_delete_version;
+CREATE TRIGGER trg_users_delete_version
+AFTER DELETE ON users
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE namespace = 'users';
+END;
@@ -0,0 +1,124 @@
+"""
+Bulk user import from CSV.
+
+The CSV needs a header row with `name` and `email` columns and may have an
+`is_admin` column (true/yes/1). Every row is validated up front; users are
+then created in one transaction, which also queues their welcome emails in
+the outbox, spaced out so a large import doesn't crowd out other mail.
+"""
+
+import csv
+import click
+from flask import current_app, url_for
+from email_validator import validate_email, EmailNotValidError
+
+from app import outbox
+from app.email import compose_welcome_email
+from app.models import User
+
+_TRUE = {'1', 'true', 'yes', 'y'}
+
+
+class ImportResult:
+    """What an import did: users created, rows skipped and rows rejected."""
+
+    def __init__(self):
+        self.created = []     # (name, email)
+        self.existing = []    # emails that already had an account
+        self.errors = []      # (line number, message)
+        self.emails_queued = 0
+
+
+def parse_users(lines):
+    """
+    Read and validate CSV rows.
+
+    Returns (users, errors): users is a list of (line, name, email, is_admin)
+    with emails normalized to lowercase and duplicates within the file
+    removed; errors is a list of (line, message).
+    """
+    reader = csv.DictReader(lines)
+    fields = {name.strip().lower() for name in (reader.fieldnames or [])}
+    if not {'name', 'email'} <= fields:
+        return [], [(1, 'The header row must include "name" and "email" columns.')]
+
+    users = []
+    errors = []
+    seen = set()
+    for row in reader:
+        line = reader.line_num
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()
+               if not isinstance(value, list)}
+        name = row.get('name', '')
+        email = row.get('email', '').lower()
+        if not name and not email:
+            continue
+        if not 2 <= len(name) <= 100:
+            errors.append((line, 'Name must be between 2 and 100 characters.'))
+            continue
+        try:
+            email = validate_email(email, check_deliverability=False).normalized.lower()
+        except EmailNotValidError as e:
+            errors.append((line, f'Invalid email address: {e}'))
+            continue
+        if email in seen:
+            errors.append((line, f'Duplicate of an earlier row: {email}'))
+            continue
+        seen.add(email)
+        users.append((line, name, email, row.get('is_admin', '').lower() in _TRUE))
+    return users, errors
+
+
+def import_users(lines, send_welcome=True):
+    """
+    Create users from CSV lines and queue their welcome emails.
+
+    Needs a request context (real or test) so login links can be built.
+    """
+    result = ImportResult()
+    users, result.errors = parse_users(lines)
+    if not users:
+        return result
+
+    rate = current_app.config.get('IMPORT_WELCOME_RATE', 2.0)
+    interval = 1.0 / rate if send_welcome and rate > 0 else 0.0
+
+    def notify(created, db):
+        # Queued in the accounts' own transaction, so no user misses their email
+        result.emails_queued = outbox.enqueue(
+            ((email,
+              *compose_welcome_email(name, url_for('auth.verify_login', token=token, _external=True)),
+              send_at)
+             for name, email, token, send_at in created),
+            db=db
+        )
+
+    created = User.bulk_create([(name, email, is_admin) for _, name, email, is_admin in users],
+                               send_interval=interval, notify=notify if send_welcome else None)
+
+    created_emails = {email for _, email, _, _ in created}
+    result.created = [(name, email) for name, email, _, _ in created]
+    result.existing = [email for _, _, email, _ in users if email not in created_emails]
+    return result
+
+
+@click.command('import-users')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--no-email', is_flag=True, help='Create the accounts without sending welcome emails.')
+def import_users_command(csv_file, no_email):
+    """Create users from a CSV file with name, email and optional is_admin columns."""
+    app = current_app._get_current_object()
+    # Login links in the emails are built against APP_URL
+    with app.test_request_context(base_url=app.config.get('APP_URL')):
+        result = import_users(csv_file, send_welcome=not no_email)
+
+    for line, message in result.errors:
+        click.echo(f'Line {line}: {message}', err=True)
+    click.echo(f'Created {len(result.created)} user(s); '
+               f'{len(result.existing)} already existed; {len(result.errors)} row(s) rejected.')
+    if result.emails_queued:
+        click.echo(f'Queued {result.emails_queued} welcome email(s).')
+
+
+def init_app(app):
+    app.cli.add_command(import_users_command)
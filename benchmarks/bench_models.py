@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Compare materializing submissions as __slots__ models vs. the old dict path.
+
+Usage: python benchmarks/bench_models.py [--rows 100000]
+
+Builds a throwaway database, then loads every submission for one event
+twice: once the way the models used to (sqlite3.Row -> dict -> instance
+__dict__) and once through Submission.get_all_for_event. Reports wall time
+and the memory held by the resulting objects.
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from app import create_app  # noqa: E402
+from app.db import get_db, init_db  # noqa: E402
+from app.models import Submission, encode_preferences  # noqa: E402
+
+
+class LegacySubmission:
+    """The pre-__slots__ Submission, built with Submission(**dict(row))."""
+
+    def __init__(self, id, event_id, user_id, preferences, notes, allocated, submitted_at, updated_at, **kwargs):
+        self.id = id
+        self.event_id = event_id
+        self.user_id = user_id
+        self.preferences = preferences
+        self.notes = notes
+        self.allocated = allocated
+        self.submitted_at = submitted_at
+        self.updated_at = updated_at
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+def legacy_load(event_id):
+    rows = get_db().execute(
+        '''SELECT s.*, u.name as user_name, u.email as user_email
+           FROM submissions s
+           JOIN users u ON s.user_id = u.id
+           WHERE s.event_id = ?
+           ORDER BY u.name''',
+        (event_id,)
+    ).fetchall()
+    return [LegacySubmission(**dict(row)) for row in rows]
+
+
+def populate(rows):
+    db = get_db()
+    db.executemany(
+        'INSERT INTO users (name, email) VALUES (?, ?)',
+        ((f'User {i:06d}', f'user{i}@example.com') for i in range(rows))
+    )
+    db.execute(
+        "INSERT INTO events (name, event_date, total_tickets, created_by) VALUES ('Bench', '2030-01-01 19:00', 100, 1)"
+    )
+    tiers = ['4,2,1,0', '2,1,0', '3,0', '1,0']
+    submissions = []
+    for i in range(rows):
+        prefs, first, minimum, mask = encode_preferences(tiers[i % len(tiers)])
+        submissions.append((1, i + 1, prefs, first, minimum, mask, i % 3))
+    db.executemany(
+        '''INSERT INTO submissions
+               (event_id, user_id, preferences, first_choice, min_acceptable, tier_mask, allocated)
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        submissions
+    )
+    db.commit()
+
+
+def measure(label, loader):
+    gc.collect()
+    start = time.perf_counter()
+    objects = loader()
+    elapsed = time.perf_counter() - start
+    del objects
+
+    gc.collect()
+    tracemalloc.start()
+    objects = loader()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(objects)
+    del objects
+
+    print(f'{label:<10} {count:>8} rows  {elapsed * 1000:9.1f} ms  {retained / 1024 / 1024:8.1f} MiB retained')
+    return elapsed, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+
+    class BenchConfig(Config):
+        DATABASE = path
+        EMAIL_OUTBOX_AUTOSTART = False
+
+    app = create_app(BenchConfig)
+    try:
+        with app.app_context():
+            init_db()
+            populate(args.rows)
+            legacy_time, legacy_mem = measure('dict', lambda: legacy_load(1))
+            slots_time, slots_mem = measure('__slots__', lambda: Submission.get_all_for_event(1))
+            print(f'speedup {legacy_time / slots_time:.2f}x, memory {legacy_mem / slots_mem:.2f}x smaller')
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+if __name__ == '__main__':
+    main()
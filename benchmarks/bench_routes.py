@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Latency and query counts for the hot pages and model methods.
+
+Usage: python benchmarks/bench_routes.py [--db bench.db] [--preset small]
+                                         [--requests 50] [--cold]
+                                         [--save-baseline] [--compare]
+
+Runs against a database from generate_data.py (building one at the given
+preset if --db is missing), drives the Flask test client as an admin and a
+regular user, and reports p50/p95/p99/max latency and SQL statements per
+call. --cold clears the rendered-fragment cache before every request.
+
+--save-baseline writes the results to a JSON file; --compare reads it back
+and exits non-zero when a benchmark's p95 got slower than the tolerance or
+it runs more queries than before.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from app import create_app  # noqa: E402
+from app.db import get_db  # noqa: E402
+from app.fragments import fragment_cache  # noqa: E402
+from app.models import Event, Submission, User  # noqa: E402
+from benchmarks.generate_data import PRESETS, build_database  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+class QueryCounter:
+    """Counts statements run on a connection via sqlite3's trace callback."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
+
+    def install(self, db):
+        db.set_trace_callback(self)
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(name, call, counter, iterations, before=None):
+    """Time `call` iterations times; returns a result dict in milliseconds."""
+    call()  # Warm up connections, templates and the statement cache
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        if before:
+            before()
+        counter.count = 0
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count)
+    timings.sort()
+    return {
+        'name': name,
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'max': timings[-1],
+        'mean': statistics.fmean(timings),
+        'queries': max(queries)
+    }
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def page(client, url):
+    def call():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {url} returned {response.status_code}')
+        return response
+    return call
+
+
+def pick_events():
+    """The busiest open event and the busiest finalized one."""
+    db = get_db()
+    hot_open, hot_past = (
+        db.execute(
+            '''SELECT e.id FROM events e JOIN event_stats s ON s.event_id = e.id
+               WHERE e.status = ? ORDER BY s.submission_count DESC LIMIT 1''',
+            (status,)
+        ).fetchone()[0]
+        for status in ('open', 'finalized')
+    )
+    admin_id = db.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    user_id = db.execute(
+        'SELECT user_id FROM submissions WHERE event_id = ? ORDER BY id LIMIT 1', (hot_open,)
+    ).fetchone()[0]
+    return hot_open, hot_past, admin_id, user_id
+
+
+def run(db_path, iterations, cold):
+    class BenchConfig(Config):
+        DATABASE = db_path
+        SQLITE_PERSISTENT_CONNECTIONS = True
+        EMAIL_OUTBOX_AUTOSTART = False
+        WTF_CSRF_ENABLED = False
+
+    app = create_app(BenchConfig)
+    counter = QueryCounter()
+    before = fragment_cache.clear if cold else None
+    results = []
+
+    with app.app_context():
+        # Persistent connections are per thread and outlive the app context;
+        # the test client runs requests on this thread, so every request
+        # below uses the connection traced here
+        counter.install(get_db())
+        hot_open, hot_past, admin_id, user_id = pick_events()
+
+    # Requests run outside any app context so each gets its own g
+    user = app.test_client()
+    login(user, user_id)
+    admin = app.test_client()
+    login(admin, admin_id)
+
+    routes = [
+        ('dashboard', user, '/dashboard'),
+        ('event_history', user, '/events/history'),
+        ('event_detail (open)', user, f'/events/{hot_open}'),
+        ('event_detail (finalized)', admin, f'/events/{hot_past}'),
+        ('allocate', admin, f'/events/{hot_open}/allocate'),
+        ('admin_index', admin, '/admin/'),
+        ('api_events', user, '/api/v1/events'),
+        ('api_allocations', admin, f'/api/v1/events/{hot_open}/allocations'),
+    ]
+    for name, client, url in routes:
+        results.append(measure(name, page(client, url), counter, iterations, before))
+
+    with app.app_context():
+        open_ids = [event.id for event in Event.get_all_open()]
+        models = [
+            ('Event.get_all_open', Event.get_all_open),
+            ('Event.get_stats_for_events', lambda: Event.get_stats_for_events(open_ids, user_id=user_id)),
+            ('Event.get_past_events_page', Event.get_past_events_page),
+            ('Submission.get_all_for_event', lambda: Submission.get_all_for_event(hot_open)),
+            ('User.get_page', User.get_page),
+        ]
+        for name, call in models:
+            results.append(measure(name, call, counter, iterations))
+
+        get_db().set_trace_callback(None)
+    return results
+
+
+def report(results, baseline=None, tolerance=0.25):
+    """Print a results table; returns the names that regressed against baseline."""
+    previous = {item['name']: item for item in (baseline or {}).get('results', [])}
+    regressions = []
+    print(f"{'benchmark':<32} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'queries':>8}  vs baseline")
+    for item in results:
+        line = (f"{item['name']:<32} {item['p50']:8.2f} {item['p95']:8.2f} {item['p99']:8.2f} "
+                f"{item['max']:8.2f} {item['queries']:8d}")
+        old = previous.get(item['name'])
+        if old:
+            change = item['p95'] / old['p95'] - 1 if old['p95'] else 0.0
+            line += f"  p95 {change:+.0%}, queries {item['queries'] - old['queries']:+d}"
+            if change > tolerance or item['queries'] > old['queries']:
+                regressions.append(item['name'])
+                line += '  REGRESSION'
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='Database from generate_data.py (default: build a temporary one)')
+    parser.add_argument('--preset', choices=PRESETS, default='small',
+                        help='Scale of the temporary database')
+    parser.add_argument('--requests', type=int, default=50, help='Timed calls per benchmark')
+    parser.add_argument('--cold', action='store_true', help='Clear the fragment cache before each request')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed p95 slowdown before --compare fails (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    db_path = args.db
+    temporary = not db_path or not os.path.exists(db_path)
+    if temporary:
+        db_path = db_path or os.path.join(tempfile.mkdtemp(), 'bench.db')
+        scale = PRESETS[args.preset]
+        print(f"Building {args.preset} database ({scale['users']} users, {scale['events']} events, "
+              f"{scale['submissions']} submissions)...")
+        build_database(db_path, **scale)
+
+    try:
+        results = run(db_path, args.requests, args.cold)
+    finally:
+        if temporary and not args.db:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db_path + suffix):
+                    os.unlink(db_path + suffix)
+
+    baseline = None
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'preset': args.preset, 'db': args.db, 'cold': args.cold,
+                       'requests': args.requests, 'results': results}, f, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+    if regressions:
+        print(f"Regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Worker startup cost: import time, create_app time and memory per worker.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--workers 2] [--mail]
+                                          [--save-baseline] [--compare]
+
+Every measurement runs in a fresh interpreter so nothing is already
+imported. "cold worker" times importing the app, create_app() and the first
+request in a new process, the way a gunicorn worker starts without
+--preload. The worker memory rows fork --workers processes the way gunicorn
+does, with and without preload (see gunicorn.conf.py), and report each
+worker's private memory once it has served a request: the part that is not
+shared with the master and so is paid again for every worker. --mail turns
+on the SES email backend so its imports are counted too.
+
+--save-baseline writes the results to a JSON file; --compare reads it back
+and exits non-zero when anything grew by more than the tolerance.
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_baseline.json')
+
+
+def _proc_kb(path, fields):
+    """Sum the given kB fields of a /proc status file; None where /proc is missing."""
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    total = 0
+    for line in lines:
+        name, _, value = line.partition(':')
+        if name in fields:
+            total += int(value.split()[0])
+    return total
+
+
+def rss_kb():
+    return _proc_kb('/proc/self/status', ('VmRSS',))
+
+
+def private_kb():
+    """Memory only this process maps: what each extra worker really costs."""
+    return _proc_kb('/proc/self/smaps_rollup', ('Private_Clean', 'Private_Dirty'))
+
+
+def _create_app(preload):
+    from config import Config
+    from app import create_app
+
+    class StartupConfig(Config):
+        DATABASE = os.environ['BENCH_DATABASE']
+        EMAIL_OUTBOX_AUTOSTART = False
+        METRICS_DIR = None
+        PRELOAD_APP = preload
+
+    return create_app(StartupConfig)
+
+
+def _first_request(app):
+    start = time.perf_counter()
+    response = app.test_client().get('/login')
+    if response.status_code != 200:
+        raise RuntimeError(f'GET /login returned {response.status_code}')
+    return (time.perf_counter() - start) * 1000
+
+
+def measure_cold():
+    """In a fresh interpreter: import, create_app and first request, as a new worker would."""
+    start = time.perf_counter()
+    import app  # noqa: F401
+    imported = time.perf_counter()
+    flask_app = _create_app(preload=False)
+    created = time.perf_counter()
+    return {
+        'import_ms': (imported - start) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_request_ms': _first_request(flask_app),
+        'rss_kb': rss_kb(),
+    }
+
+
+def measure_workers(workers, preload):
+    """Fork workers like gunicorn and collect each one's startup cost and private memory."""
+    flask_app = _create_app(preload=True) if preload else None
+    if preload:
+        gc.freeze()  # As gunicorn.conf.py's pre_fork does
+
+    children = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                start = time.perf_counter()
+                worker_app = flask_app or _create_app(preload=False)
+                startup_ms = (time.perf_counter() - start) * 1000
+                result = {'startup_ms': startup_ms, 'first_request_ms': _first_request(worker_app),
+                          'private_kb': private_kb()}
+                os.write(write_fd, json.dumps(result).encode())
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    results = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd) as f:
+            data = f.read()
+        os.waitpid(pid, 0)
+        if not data:
+            raise RuntimeError('worker failed')
+        results.append(json.loads(data))
+    return results
+
+
+def _child(mode, *args):
+    """Run one measurement in a new interpreter and return its JSON result."""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--measure', mode, *args],
+        check=True, capture_output=True, text=True, cwd=ROOT
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(runs, workers, mail):
+    db_dir = tempfile.mkdtemp()
+    db_path = os.path.join(db_dir, 'startup.db')
+    os.environ['BENCH_DATABASE'] = db_path
+    os.environ['MAIL_ENABLED'] = 'true' if mail else 'false'
+    _child('init-db')
+
+    try:
+        cold = [_child('cold') for _ in range(runs)]
+        plain = _child('workers', str(workers), 'plain')
+        preloaded = _child('workers', str(workers), 'preload')
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+        os.rmdir(db_dir)
+
+    def median(items, key):
+        values = [item[key] for item in items if item[key] is not None]
+        return statistics.median(values) if values else None
+
+    return [
+        {'name': 'import app', 'value': median(cold, 'import_ms'), 'unit': 'ms'},
+        {'name': 'create_app', 'value': median(cold, 'create_app_ms'), 'unit': 'ms'},
+        {'name': 'first request (cold worker)', 'value': median(cold, 'first_request_ms'), 'unit': 'ms'},
+        {'name': 'RSS after first request', 'value': median(cold, 'rss_kb'), 'unit': 'kB'},
+        {'name': 'worker startup (no preload)', 'value': median(plain, 'startup_ms'), 'unit': 'ms'},
+        {'name': 'worker private memory (no preload)', 'value': median(plain, 'private_kb'), 'unit': 'kB'},
+        {'name': 'first request (preloaded worker)', 'value': median(preloaded, 'first_request_ms'), 'unit': 'ms'},
+        {'name': 'worker private memory (preload)', 'value': median(preloaded, 'private_kb'), 'unit': 'kB'},
+    ]
+
+
+def report(results, baseline=None, tolerance=0.25):
+    """Print a results table; returns the names that regressed against baseline."""
+    previous = {item['name']: item for item in (baseline or {}).get('results', [])}
+    regressions = []
+    print(f"{'benchmark':<38} {'value':>10}  vs baseline")
+    for item in results:
+        if item['value'] is None:
+            print(f"{item['name']:<38} {'n/a':>10}")
+            continue
+        line = f"{item['name']:<38} {item['value']:10.1f} {item['unit']}"
+        old = previous.get(item['name'])
+        if old and old['value']:
+            change = item['value'] / old['value'] - 1
+            line += f"  {change:+.0%}"
+            if change > tolerance:
+                regressions.append(item['name'])
+                line += '  REGRESSION'
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters timed for the cold-worker rows')
+    parser.add_argument('--workers', type=int, default=2, help='Workers forked for the memory rows')
+    parser.add_argument('--mail', action='store_true', help='Use the SES email backend (imports boto3)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed growth before --compare fails (0.25 = 25%%)')
+    parser.add_argument('--measure', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        mode, *rest = args.measure
+        if mode == 'init-db':
+            from app.db import init_db
+            with _create_app(preload=False).app_context():
+                init_db()
+            result = {}
+        elif mode == 'cold':
+            result = measure_cold()
+        else:
+            result = measure_workers(int(rest[0]), preload=rest[1] == 'preload')
+        print(json.dumps(result))
+        return
+
+    results = run(args.runs, args.workers, args.mail)
+
+    baseline = None
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'runs': args.runs, 'workers': args.workers, 'mail': args.mail,
+                       'results': results}, f, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+    if regressions:
+        print(f"Regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Build a SQLite database shaped like a large organization's ticket pool.
+
+Usage: python benchmarks/generate_data.py bench.db [--preset large] [--users N]
+                                                   [--events N] [--submissions N]
+
+Users, events and submissions are written with bulk SQL; preference tiers
+are drawn to look like real requests (mostly 1-4 tickets, with one or two
+fallback tiers). Past events are finalized with allocations; the most
+recent events are open, and the first open event is the busiest so route
+benchmarks have a large allocation table to render.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from app import create_app  # noqa: E402
+from app.db import get_db, init_db  # noqa: E402
+from app.models import encode_preferences  # noqa: E402
+
+PRESETS = {
+    'small': {'users': 1_000, 'events': 200, 'submissions': 50_000},
+    'medium': {'users': 5_000, 'events': 1_000, 'submissions': 250_000},
+    'large': {'users': 10_000, 'events': 2_000, 'submissions': 1_000_000},
+}
+
+# Share of events still open; the rest are in the past
+OPEN_FRACTION = 0.05
+
+# Triggers that maintain event_stats row by row; bulk loads drop them and
+# init_db() recreates them and rebuilds the stats afterwards
+_STATS_TRIGGERS = ('trg_submissions_insert_stats', 'trg_submissions_update_stats',
+                   'trg_submissions_update_version', 'trg_submissions_delete_stats',
+                   'trg_events_insert_stats', 'trg_events_update_version')
+
+
+def random_preferences(rng):
+    """A descending list of acceptable ticket counts ending in 0, e.g. [4, 2, 1, 0]."""
+    first = rng.choices([1, 2, 3, 4, 5, 6], weights=[25, 40, 12, 15, 4, 4])[0]
+    tiers = [first]
+    if first > 1:
+        lower = list(range(1, first))
+        tiers += sorted(rng.sample(lower, k=min(len(lower), rng.choice([0, 1, 1, 2]))), reverse=True)
+    return tiers + [0]
+
+
+def submission_counts(rng, events, total, users):
+    """
+    Split `total` submissions across events with a long tail, capped at
+    `users` each and at least one per event.
+    """
+    weights = [rng.paretovariate(1.5) for _ in range(events)]
+    scale = total / sum(weights)
+    shares = [w * scale for w in weights]
+    counts = [min(users, max(1, int(share))) for share in shares]
+    # Hand the remainder lost to truncation and the cap to the largest
+    # fractional parts, so the counts add up to exactly `total`
+    order = sorted(range(events), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    remaining = min(total, events * users) - sum(counts)
+    while remaining > 0:
+        for i in order:
+            if remaining and counts[i] < users:
+                counts[i] += 1
+                remaining -= 1
+    # The one-per-event minimum can overshoot; take the excess back
+    for i in reversed(order):
+        if remaining < 0 and counts[i] > 1:
+            counts[i] -= 1
+            remaining += 1
+    # Give the busiest event to the first open one
+    busiest = counts.index(max(counts))
+    first_open = events - max(1, int(events * OPEN_FRACTION))
+    counts[busiest], counts[first_open] = counts[first_open], counts[busiest]
+    return counts
+
+
+def generate(users, events, submissions, seed=0):
+    rng = random.Random(seed)
+    db = get_db()
+    for trigger in _STATS_TRIGGERS:
+        db.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+
+    db.executemany(
+        'INSERT INTO users (name, email, is_admin, must_reset_password) VALUES (?, ?, ?, 0)',
+        ((f'User {i:06d}', f'user{i}@example.com', 1 if i < 5 else 0) for i in range(users))
+    )
+
+    now = datetime.now().replace(microsecond=0)
+    open_count = max(1, int(events * OPEN_FRACTION))
+    event_rows = []
+    for i in range(events):
+        is_open = i >= events - open_count
+        if is_open:
+            event_date = now + timedelta(days=rng.randint(3, 90), hours=rng.randint(0, 5))
+            status, finalized_at = 'open', None
+        else:
+            # Past events spread over three years, oldest first
+            event_date = now - timedelta(days=(events - i) * 1095 // events, hours=rng.randint(0, 5))
+            status = 'cancelled' if rng.random() < 0.03 else 'finalized'
+            finalized_at = event_date - timedelta(days=2) if status == 'finalized' else None
+        event_rows.append((f'Event {i:05d}', event_date.strftime('%Y-%m-%d %H:%M'),
+                           rng.choice([2, 4, 8, 10, 20, 50]), status, rng.randint(1, users),
+                           finalized_at))
+    db.executemany(
+        '''INSERT INTO events (name, event_date, total_tickets, status, created_by, finalized_at)
+           VALUES (?, ?, ?, ?, ?, ?)''',
+        event_rows
+    )
+
+    counts = submission_counts(rng, events, submissions, users)
+
+    def submission_rows():
+        for event_id, count in enumerate(counts, 1):
+            finalized = event_rows[event_id - 1][3] == 'finalized'
+            for user_id in rng.sample(range(1, users + 1), count):
+                prefs, first, minimum, mask = encode_preferences(random_preferences(rng))
+                allocated = rng.choice([t for t in range(first + 1) if t == 0 or mask >> t & 1]) \
+                    if finalized else None
+                yield event_id, user_id, prefs, first, minimum, mask, allocated
+
+    db.executemany(
+        '''INSERT INTO submissions
+               (event_id, user_id, preferences, first_choice, min_acceptable, tier_mask, allocated)
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        submission_rows()
+    )
+    db.commit()
+    # Recreates the triggers and rebuilds event_stats from the loaded rows
+    init_db()
+    db.execute('ANALYZE')
+    db.commit()
+    return sum(counts)
+
+
+def build_database(path, users, events, submissions, seed=0):
+    """Create a fresh database at path and fill it. Returns the submission count."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+
+    class GeneratorConfig(Config):
+        DATABASE = path
+        EMAIL_OUTBOX_AUTOSTART = False
+
+    app = create_app(GeneratorConfig)
+    with app.app_context():
+        init_db()
+        return generate(users, events, submissions, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='Database file to create (overwritten)')
+    parser.add_argument('--preset', choices=PRESETS, default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--events', type=int)
+    parser.add_argument('--submissions', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    scale = dict(PRESETS[args.preset])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+
+    start = time.perf_counter()
+    written = build_database(args.path, scale['users'], scale['events'], scale['submissions'], args.seed)
+    print(f"{scale['users']} users, {scale['events']} events, {written} submissions "
+          f"written to {args.path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 from dotenv import load_dotenv
 
@@ -9,17 +10,100 @@ class Config:
     DATABASE = os.environ.get('DATABASE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tickets.db')
     WTF_CSRF_ENABLED = True
 
+    # Warm imports and templates in create_app (set by gunicorn.conf.py for --preload)
+    PRELOAD_APP = os.environ.get('PRELOAD_APP', 'false').lower() == 'true'
+
+    # SQLite connection tuning; each PRAGMA runs once per new connection
+    SQLITE_PERSISTENT_CONNECTIONS = os.environ.get('SQLITE_PERSISTENT_CONNECTIONS', 'true').lower() == 'true'
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))  # milliseconds
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', '-16000'))  # negative = KiB
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024)))
+    SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+
+    # Per-request SQL timing: Server-Timing header, JSON log line and query budgets
+    # (see app/instrumentation.py)
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', 'true').lower() == 'true'
+    SQL_SLOW_STATEMENTS = int(os.environ.get('SQL_SLOW_STATEMENTS', '3'))  # statements per log line
+    SQL_QUERY_BUDGET_MODE = os.environ.get('SQL_QUERY_BUDGET_MODE', 'warn')  # 'warn' or 'raise'
+    SQL_QUERY_BUDGETS = {}  # endpoint -> statements, for views without @query_budget
+
+    # Prometheus metrics at /admin/metrics (see app/metrics.py). Workers share
+    # totals through files in METRICS_DIR; without it each worker reports its own
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))  # seconds
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # bearer token for scrapers
+
+    # Request profiling (see app/profiling.py): admins send X-Profile: 1 or ?_profile=1,
+    # and PROFILE_SAMPLE_RATE = N also profiles 1 in N requests from anyone
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILE_SAMPLE_RATE = int(os.environ.get('PROFILE_SAMPLE_RATE', '0'))  # 0 = only on request
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.005'))  # seconds between samples
+    PROFILE_MAX_CONCURRENT = int(os.environ.get('PROFILE_MAX_CONCURRENT', '2'))  # per worker
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '50'))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'ticket-pool-profiles')
+
+    # Login link requests allowed per client IP and per email address: up to LIMIT
+    # at once, refilling over PERIOD seconds. Backend 'sqlite' shares the limits
+    # between workers, 'memory' keeps them per worker, 'off' disables them.
+    LOGIN_RATE_LIMIT_BACKEND = os.environ.get('LOGIN_RATE_LIMIT_BACKEND', 'sqlite')
+    LOGIN_RATE_LIMIT_IP = int(os.environ.get('LOGIN_RATE_LIMIT_IP', '20'))
+    LOGIN_RATE_LIMIT_IP_PERIOD = float(os.environ.get('LOGIN_RATE_LIMIT_IP_PERIOD', '600'))
+    LOGIN_RATE_LIMIT_EMAIL = int(os.environ.get('LOGIN_RATE_LIMIT_EMAIL', '5'))
+    LOGIN_RATE_LIMIT_EMAIL_PERIOD = float(os.environ.get('LOGIN_RATE_LIMIT_EMAIL_PERIOD', '900'))
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted for the client IP
+    PROXY_COUNT = int(os.environ.get('PROXY_COUNT', '0'))
+
     # Session cookie configuration - 1 year lifetime
     REMEMBER_COOKIE_DURATION = timedelta(days=365)
     REMEMBER_COOKIE_SECURE = os.environ.get('COOKIE_SECURE', 'true').lower() == 'true'
     REMEMBER_COOKIE_HTTPONLY = True
     REMEMBER_COOKIE_SAMESITE = 'Lax'
 
+    # Rows per page on paginated listings (history, admin users)
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', '50'))
+
+    # Per-process cache of logged-in users (see load_user)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '1024'))
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '300'))  # seconds
+
+    # Per-process cache of event listings, dropped whenever any worker writes an event
+    # or submission (see app/coherence.py)
+    EVENT_CACHE_SIZE = int(os.environ.get('EVENT_CACHE_SIZE', '256'))  # 0 disables
+
+    # Per-process cache of rendered event cards and history rows (see app/fragments.py)
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', '4096'))  # 0 disables
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+
+    # Welcome emails per second queued by bulk user imports
+    IMPORT_WELCOME_RATE = float(os.environ.get('IMPORT_WELCOME_RATE', '2'))
+
+    # Live update streams (see events.event_stream)
+    SSE_CHECK_INTERVAL = float(os.environ.get('SSE_CHECK_INTERVAL', '15'))  # seconds between version checks
+    SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', '300'))  # seconds before the browser reconnects
+    # Each open stream holds a gunicorn thread; keep this below GUNICORN_THREADS
+    SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', '4'))  # per worker
+    SSE_BUSY_RETRY = int(os.environ.get('SSE_BUSY_RETRY', '30'))  # seconds, sent with the 503 when full
+
     # AWS SES Email Configuration
     MAIL_ENABLED = os.environ.get('MAIL_ENABLED', 'false').lower() == 'true'
+    # Backend used while MAIL_ENABLED: a name from app.email.BACKENDS or a dotted class path
+    MAIL_BACKEND = os.environ.get('MAIL_BACKEND', 'ses')
     AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
     SES_SENDER_EMAIL = os.environ.get('SES_SENDER_EMAIL', 'noreply@example.com')
+    SES_TEMPLATE_PREFIX = os.environ.get('SES_TEMPLATE_PREFIX', 'ticket-pool')
+    SES_MAX_POOL_CONNECTIONS = int(os.environ.get('SES_MAX_POOL_CONNECTIONS', '10'))
     APP_NAME = os.environ.get('APP_NAME', 'Ticket Pool')
     APP_URL = os.environ.get('APP_URL', 'http://localhost:5000')
+
+    # Email outbox worker
+    EMAIL_OUTBOX_AUTOSTART = os.environ.get('EMAIL_OUTBOX_AUTOSTART', 'true').lower() == 'true'
+    EMAIL_OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS', '4'))
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', '50'))
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', '5'))
+    EMAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get('EMAIL_OUTBOX_POLL_INTERVAL', '2'))
+    SES_MAX_SEND_RATE = float(os.environ.get('SES_MAX_SEND_RATE', '14'))
@@ -0,0 +1,39 @@
+"""Gunicorn settings used by the Docker image (gunicorn -c gunicorn.conf.py run:app)."""
+
+import gc
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Threaded workers so long-lived live-update streams don't block other requests.
+# Each open stream holds one thread for up to SSE_MAX_DURATION, and a worker
+# opens at most SSE_MAX_STREAMS (default 4) of them, so threads must exceed
+# SSE_MAX_STREAMS by enough to serve ordinary requests; raise both together.
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# Load the app once in the master and fork workers from it, so imports and
+# compiled templates are shared copy-on-write instead of built per worker.
+# Nothing in create_app opens a database connection or starts a thread;
+# those are created per process on first use.
+preload_app = True
+os.environ.setdefault('PRELOAD_APP', 'true')
+
+
+def pre_fork(server, worker):
+    # Move the preloaded objects out of the collector's reach; collections in
+    # the workers would otherwise write to (and so copy) every page they touch
+    gc.freeze()
+
+
+def on_starting(server):
+    # Files left by the previous run's workers would otherwise be summed forever
+    if os.environ.get('METRICS_DIR'):
+        from app.metrics import remove_files
+        remove_files(os.environ['METRICS_DIR'])
+
+
+def child_exit(server, worker):
+    # Drop an exited (or recycled) worker's metrics; see app/metrics.py
+    if os.environ.get('METRICS_DIR'):
+        from app.metrics import remove_files
+        remove_files(os.environ['METRICS_DIR'], worker.pid)